@@ -0,0 +1,42 @@
+""" Hands a PEST model call to the sm_pst_daemon of this worker directory.
+    Runs the forward run in this process if no daemon is running. The config
+    file given here is sent with the request; without one, the daemon uses
+    its own.
+
+    Usage (model command line in the *.pst file):
+        python forward_run_client.py [forward_run.json]
+"""
+
+import os
+import sys
+import json
+import socket
+
+
+PORT_FILE = 'sm_pst_daemon.port'
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    try:
+        with open(PORT_FILE) as f:
+            port = int(f.read())
+        sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+    except (OSError, ValueError):
+        from sm_pst_run import main as forward_run
+        forward_run(argv)
+        return
+    sock.settimeout(None)
+    with sock, sock.makefile('rw') as f:
+        request = {'cmd': 'run'}
+        if argv:
+            request['config'] = os.path.abspath(argv[0])
+        f.write(json.dumps(request) + '\n')
+        f.flush()
+        reply = json.loads(f.readline())
+    if reply['status'] != 'ok':
+        sys.exit(reply['message'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+""" Benchmarks of the forward run hot paths on synthetic SWAT-MODFLOW outputs
+    (see sm_pst_synth), so performance changes show up as numbers.
+
+    Usage:
+        python sm_pst_bench.py --reaches 500 --years 30 --riv-cells 50000 --out new.json
+        python sm_pst_bench.py --out new.json --compare base.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import statistics
+from datetime import datetime
+
+
+def timeit(func, args=(), kwargs=None, repeat=3, setup=None):
+    """time a function call.
+
+    Args:
+        - func (`callable`): the function to time
+        - args (`tuple`, optional): positional arguments. Defaults to ()
+        - kwargs (`dict`, optional): keyword arguments. Defaults to None
+        - repeat (`int`, optional): number of timed calls. Defaults to 3
+        - setup (`callable`, optional): called before each call, not timed. Defaults to None
+
+    Returns:
+        `list`: wall time of each call (s)
+    """
+
+    kwargs = kwargs or {}
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        # the functions print progress messages
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def _pick(ids, n=10):
+    # n ids spread over the whole range
+    step = max(len(ids) // n, 1)
+    return list(ids[::step][:n])
+
+
+def run_benchmarks(wd=None, repeat=3, out_file=None, keep=False, **case):
+    """generate a synthetic case and time the extractors, riv_par and the
+       instruction file writers on it.
+
+    Args:
+        - wd (`str`, optional): folder of the synthetic case. If None, a temporary
+            folder is used. Defaults to None
+        - repeat (`int`, optional): timed calls of each benchmark. Defaults to 3
+        - out_file (`str`, optional): json file to write the results to. Defaults to None
+        - keep (`bool`, optional): keep the temporary folder. Defaults to False
+        - case: sizes of the case, see `sm_pst_synth.make_case`
+
+    Example:
+        sm_pst_bench.run_benchmarks(n_reaches=500, years=30, n_riv_cells=50000)
+
+    Returns:
+        `dict`: case sizes and the min/median time (s) of each benchmark
+    """
+
+    import pandas as pd
+    import sm_pst_synth
+    import sm_pst_utils
+    import sm_pst_par
+
+    tmp = wd is None
+    wd = os.path.abspath(tempfile.mkdtemp(prefix='sm_pst_bench_') if tmp else wd)
+    cwd = os.getcwd()
+    try:
+        start = time.perf_counter()
+        info = sm_pst_synth.make_case(wd, **case)
+        print('case written in {:.1f} s'.format(time.perf_counter() - start))
+        os.chdir(wd)
+
+        start_day = pd.Timestamp(info['start_day'])
+        end_day = start_day + pd.DateOffset(years=info['years']) - pd.DateOffset(days=1)
+        cali_start = start_day + pd.DateOffset(years=min(1, info['years'] - 1))
+        start_day, end_day, cali_start = [x.strftime('%m/%d/%Y') for x in (start_day, end_day, cali_start)]
+        channels = _pick(range(1, info['n_reaches'] + 1))
+        subs = _pick(range(1, info['n_subs'] + 1))
+        chas = _pick(range(1, info['n_channels'] + 1))
+        grid_ids = _pick(info['grid_ids'])
+
+        # observation files for the *_to_ins writers
+        sub_cols = ['sub{:03d}'.format(i) for i in channels]
+        wt_cols = ['wt{}'.format(i) for i in grid_ids]
+        sm_pst_synth.write_obd('streamflow.obd', sub_cols, start_day, end_day, freq='M')
+        sm_pst_synth.write_obd('modflow.obd', wt_cols, start_day, end_day, freq='D')
+        shutil.copy('synth.riv', 'synth.riv.bench')
+        cell_ids = _pick(range(1, info['n_riv_cells'] + 1), 50)
+
+        def riv_cold():
+            # first run of a worker: no backup, index or memo
+            for f in ['riv_package.org', 'riv_package.org.idx']:
+                if os.path.exists(f):
+                    os.remove(f)
+            shutil.copy('synth.riv.bench', 'synth.riv')
+            sm_pst_par._riv_packages.clear()
+
+        def riv_index():
+            # later runs of a script worker: index file, no memo
+            sm_pst_par._riv_packages.clear()
+
+        def riv_detail():
+            sm_pst_synth.write_mf_riv_par('mf_riv.par', info['n_riv_groups'], cell_ids=cell_ids)
+
+        benches = [
+            ('extract_month_str', sm_pst_utils.extract_month_str,
+                ('output.rch', channels, start_day, cali_start, end_day), None),
+            ('extract_month_baseflow', sm_pst_utils.extract_month_baseflow,
+                ('output.sub', subs, start_day, cali_start, end_day), None),
+            ('extract_watertable_sim', sm_pst_utils.extract_watertable_sim,
+                (grid_ids, start_day, end_day), None),
+            ('extract_month_avg', sm_pst_utils.extract_month_avg,
+                (wd, chas, start_day), None),
+            ('riv_par (cold)', sm_pst_par.riv_par, (wd,), riv_cold),
+            ('riv_par (index file)', sm_pst_par.riv_par, (wd,), riv_index),
+            ('riv_par (in memory)', sm_pst_par.riv_par, (wd,), None),
+            ('str_obd_to_ins', sm_pst_utils.str_obd_to_ins,
+                ('cha_{:03d}.txt'.format(channels[0]), sub_cols[0], cali_start, end_day), None),
+            ('str_obd_to_ins_batch', sm_pst_utils.str_obd_to_ins_batch,
+                ({c: 'cha_{:03d}.txt'.format(i) for c, i in zip(sub_cols, channels)}, cali_start, end_day),
+                None),
+            ('mf_obd_to_ins', sm_pst_utils.mf_obd_to_ins,
+                ('wt_{}.txt'.format(grid_ids[0]), wt_cols[0], start_day, end_day), None),
+            ('mf_obd_to_ins_batch', sm_pst_utils.mf_obd_to_ins_batch,
+                ({c: 'wt_{}.txt'.format(i) for c, i in zip(wt_cols, grid_ids)}, start_day, end_day),
+                None),
+            ('riv_par_more_detail', sm_pst_par.riv_par_more_detail, (wd,), riv_detail),
+            ]
+
+        results = {}
+        print('{:<26s}{:>10s}{:>10s}'.format('benchmark', 'min (s)', 'median'))
+        for name, func, args, setup in benches:
+            times = timeit(func, args, repeat=repeat, setup=setup)
+            os.chdir(wd)
+            results[name] = {'min': min(times), 'median': statistics.median(times), 'repeat': repeat}
+            print('{:<26s}{:10.4f}{:10.4f}'.format(name, min(times), statistics.median(times)))
+    finally:
+        os.chdir(cwd)
+        if tmp and not keep:
+            shutil.rmtree(wd, ignore_errors=True)
+
+    info.pop('grid_ids')
+    out = {
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'pandas': pd.__version__,
+        'case': info,
+        'results': results,
+        }
+    if out_file is not None:
+        with open(out_file, 'w') as f:
+            json.dump(out, f, indent=2)
+        print('Benchmark results have been written to "{}"...'.format(out_file))
+    return out
+
+
+def compare(base_file, new_file, tolerance=0.2):
+    """compare two benchmark result files.
+
+    Args:
+        - base_file (`str`): results of the baseline
+        - new_file (`str`): results to check
+        - tolerance (`float`, optional): allowed slowdown of the min time, as a
+            fraction. Defaults to 0.2
+
+    Returns:
+        `list`: benchmarks slower than the tolerance
+    """
+
+    with open(base_file) as f:
+        base = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    if base['case'] != new['case']:
+        print('WARNING: the cases differ, {} vs {}'.format(base['case'], new['case']))
+    slower = []
+    print('{:<26s}{:>10s}{:>10s}{:>8s}'.format('benchmark', 'base', 'new', 'ratio'))
+    for name, res in new['results'].items():
+        if name not in base['results']:
+            continue
+        ratio = res['min'] / base['results'][name]['min']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  SLOWER'
+            slower.append(name)
+        print('{:<26s}{:10.4f}{:10.4f}{:8.2f}{}'.format(
+            name, base['results'][name]['min'], res['min'], ratio, flag))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the sm_pst_* hot paths on a synthetic case')
+    parser.add_argument('--reaches', type=int, default=100)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--freq', default='M')
+    parser.add_argument('--obs-cells', type=int, default=50)
+    parser.add_argument('--riv-cells', type=int, default=10000)
+    parser.add_argument('--riv-groups', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--wd', help='folder of the synthetic case (default: temporary)')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary case folder')
+    parser.add_argument('--out', help='json file for the results')
+    parser.add_argument('--compare', help='baseline json file; exits with 1 if slower')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    run_benchmarks(
+        wd=args.wd, repeat=args.repeat, out_file=args.out, keep=args.keep,
+        n_reaches=args.reaches, years=args.years, freq=args.freq,
+        n_obs_cells=args.obs_cells, n_riv_cells=args.riv_cells, n_riv_groups=args.riv_groups)
+    if args.compare:
+        if args.out is None:
+            parser.error('--compare needs --out')
+        if compare(args.compare, args.out, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
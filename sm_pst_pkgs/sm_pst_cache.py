@@ -0,0 +1,161 @@
+""" Model run result cache: reuses the extracted simulated values of a previous
+    run with exactly the same parameter input files.
+
+    Entries are folders named by the hash of the parameter files in a cache
+    folder that can be shared by all workers; the least recently used entries
+    are removed when the cache grows over its size limit.
+"""
+
+import os
+import shutil
+import hashlib
+
+
+def run_key(par_files, extra=None):
+    """hash the contents of the parameter input files of a run.
+
+    Args:
+        - par_files (`list`): parameter input files, e.g. ['model.in', 'mf_riv.par']
+        - extra (`str`, optional): anything else that changes the outputs
+            (e.g. the forward run config). Defaults to None
+
+    Returns:
+        `str`: key of the run
+    """
+
+    h = hashlib.sha1()
+    for par_file in par_files:
+        h.update(os.path.basename(par_file).encode() + b'\0')
+        if os.path.exists(par_file):
+            with open(par_file, 'rb') as f:
+                h.update(f.read())
+        h.update(b'\0')
+    if extra is not None:
+        h.update(extra.encode())
+    return h.hexdigest()
+
+
+def entry_names(out_files, wd='.'):
+    """names of output files inside a cache entry: their paths relative to `wd`.
+
+    Args:
+        - out_files (`list`): output files, relative to `wd` or absolute
+        - wd (`str`, optional): working directory. Defaults to '.'
+
+    Raises:
+        Exception: a file is outside `wd`
+
+    Returns:
+        `list`: relative names
+    """
+
+    names = []
+    for f in out_files:
+        try:
+            rel = os.path.relpath(os.path.join(wd, f), wd)
+        except ValueError:
+            # another drive on Windows
+            rel = os.pardir
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep) or os.path.isabs(rel):
+            raise Exception("'{}' is outside the working directory and cannot be cached".format(f))
+        names.append(rel)
+    return names
+
+
+def _entry_files(entry):
+    files = []
+    for root, _, names in os.walk(entry):
+        files.extend(os.path.relpath(os.path.join(root, x), entry) for x in names)
+    return files
+
+
+def restore_run(cache_dir, key, wd='.'):
+    """copy the cached outputs of a run into the working directory.
+
+    Args:
+        - cache_dir (`str`): the cache folder
+        - key (`str`): key of the run from `run_key`
+        - wd (`str`, optional): working directory. Defaults to '.'
+
+    Returns:
+        `list`: restored files, or None if the run is not in the cache
+    """
+
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    try:
+        files = _entry_files(entry)
+        for f in files:
+            # entry names are relative to the working directory, see `entry_names`
+            os.makedirs(os.path.dirname(os.path.join(wd, f)) or '.', exist_ok=True)
+            shutil.copyfile(os.path.join(entry, f), os.path.join(wd, f))
+        # mark as recently used
+        os.utime(entry)
+    except OSError:
+        # removed by another worker in the meantime
+        return None
+    return files
+
+
+def store_run(cache_dir, key, out_files, wd='.', max_mb=None):
+    """store the outputs of a run in the cache.
+
+    Args:
+        - cache_dir (`str`): the cache folder
+        - key (`str`): key of the run from `run_key`
+        - out_files (`list`): output files of the run, inside `wd`; stored under
+            their paths relative to `wd`, see `entry_names`
+        - wd (`str`, optional): working directory. Defaults to '.'
+        - max_mb (`float`, optional): size limit of the cache in MB.
+            If None, no limit. Defaults to None
+    """
+
+    entry = os.path.join(cache_dir, key)
+    if os.path.isdir(entry):
+        return
+    names = entry_names(out_files, wd)
+    tmp = os.path.join(cache_dir, '.tmp_{}_{}'.format(os.getpid(), key))
+    os.makedirs(tmp, exist_ok=True)
+    for name in names:
+        os.makedirs(os.path.dirname(os.path.join(tmp, name)), exist_ok=True)
+        shutil.copyfile(os.path.join(wd, name), os.path.join(tmp, name))
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # stored by another worker in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+    if max_mb is not None:
+        evict(cache_dir, max_mb)
+
+
+def evict(cache_dir, max_mb):
+    """remove the least recently used entries until the cache is under its size limit.
+
+    Args:
+        - cache_dir (`str`): the cache folder
+        - max_mb (`float`): size limit of the cache in MB
+
+    Returns:
+        `list`: removed keys
+    """
+
+    entries = []
+    for key in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, key)
+        if key.startswith('.') or not os.path.isdir(entry):
+            continue
+        try:
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in _entry_files(entry))
+            entries.append((os.path.getmtime(entry), size, key))
+        except OSError:
+            continue
+    total = sum(x[1] for x in entries)
+    removed = []
+    for _, size, key in sorted(entries):
+        if total <= max_mb * 1024 * 1024:
+            break
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
+        removed.append(key)
+    return removed
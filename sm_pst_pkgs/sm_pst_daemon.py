@@ -0,0 +1,94 @@
+""" Persistent forward run daemon: keeps pandas, the sm_pst_* modules, the
+    parsed river package/SWAT indexes, modflow.obs and the date indexes and
+    observation names of the extractors in memory between PEST model calls.
+
+    Usage: use 'python forward_run_client.py' as the model command line in the
+    *.pst file and let the run manager start a daemon in each worker directory,
+        sm_pst_utils.execute_beopest(..., daemon='forward_run.json')
+    so the daemon and its model runs are in the process group and placement of
+    the worker (see `sm_pst_workers.RunManager`). A daemon started by hand,
+        python sm_pst_daemon.py forward_run.json
+    runs outside the worker: pinning, pausing, stopping and the load scaling of
+    the run manager do not apply to its model runs.
+"""
+
+import os
+import sys
+import json
+import signal
+import socket
+import traceback
+
+
+PORT_FILE = 'sm_pst_daemon.port'
+
+
+def serve(config='forward_run.json', wd=None, port=0, port_file=PORT_FILE):
+    """run forward runs on request from `forward_run_client.py` until stopped.
+
+    Args:
+        - config (`str` or `dict`, optional): forward run config used when a
+            request has none, see `sm_pst_run.read_config`. Defaults to 'forward_run.json'
+        - wd (`str`, optional): working directory. If None, the current
+            directory. Defaults to None
+        - port (`int`, optional): local port to listen on. If 0, a free port
+            is used. Defaults to 0
+        - port_file (`str`, optional): file in `wd` the port is written to for
+            the client. Defaults to 'sm_pst_daemon.port'
+    Note:
+        Requests are one json line, {"cmd": "run", "config": "path/forward_run.json"}
+        ("config" optional) or {"cmd": "stop"}; the reply is {"status": "ok"} or
+        {"status": "error", "message": ...}.
+        The daemon only listens on 127.0.0.1.
+    """
+
+    from sm_pst_run import forward_run
+    # preload the modules used by the runs
+    import sm_pst_par
+    import sm_pst_swat
+    import sm_pst_utils
+
+    wd = os.path.abspath(wd or os.getcwd())
+    port_file = os.path.join(wd, port_file)
+    # stopped with its worker: remove the port file on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(1)
+    with open(port_file, 'w') as f:
+        f.write(str(server.getsockname()[1]))
+    print('sm_pst_daemon is listening on port {} for "{}"...'.format(server.getsockname()[1], wd))
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile('rw') as f:
+                try:
+                    request = json.loads(f.readline())
+                except ValueError:
+                    continue
+                if request.get('cmd') == 'stop':
+                    f.write(json.dumps({'status': 'ok'}) + '\n')
+                    break
+                try:
+                    forward_run(request.get('config') or config, wd)
+                    reply = {'status': 'ok'}
+                except Exception:
+                    reply = {'status': 'error', 'message': traceback.format_exc()}
+                    print(reply['message'])
+                os.chdir(wd)
+                f.write(json.dumps(reply) + '\n')
+    finally:
+        server.close()
+        if os.path.exists(port_file):
+            os.remove(port_file)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    serve(argv[0] if argv else 'forward_run.json')
+
+
+if __name__ == '__main__':
+    main()
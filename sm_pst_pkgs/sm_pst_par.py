@@ -1,15 +1,16 @@
 import os
 import shutil
 import glob
+import hashlib
+import pickle
 from datetime import datetime
+import numpy as np
 import pandas as pd
-from pyemu.pst.pst_utils import SFMT,IFMT,FFMT
 
 
-wd = os.getcwd()
-os.chdir(wd)
-
 def create_riv_par(wd, chns, chg_type=None, rivcd=None, rivbot=None, val=None):
+    from pyemu.pst.pst_utils import SFMT
+
     os.chdir(wd)
     if rivcd is None:
         rivcd =  ['rivcd_{}'.format(x) for x in chns]
@@ -50,11 +51,184 @@ def read_modflow_par(wd):
     return riv_pars
 
 
-def riv_par(wd):
+# river package indexes already loaded by this process (e.g. sm_pst_daemon)
+_riv_packages = {}
+
+
+def _file_hash(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def read_riv_package(org_file='riv_package.org', idx_file=None):
+    """read the original river package through a cached binary index.
+
+    Args:
+        - org_file (`str`, optional): the path and name of the original river package.
+            Defaults to 'riv_package.org'
+        - idx_file (`str`, optional): the binary index file. If None, use
+            `org_file` + ".idx". Defaults to None
+    Note:
+        The index keeps the columns as arrays and the row positions of each
+        cell id (third last column) and channel/group (last column). It is
+        rebuilt only when the size/mtime and the hash of `org_file` changed.
+        A long-running process keeps the loaded index in memory.
+
+    Returns:
+        - `list`: the first three (header) lines of the river package
+        - `pandas.DataFrame`: the river package cells
+        - `dict`: row positions of each cell id (`-3`) and channel/group (`-1`)
+    """
+
+    if idx_file is None:
+        idx_file = org_file + ".idx"
+    st = os.stat(org_file)
+    idx = _riv_packages.get(os.path.abspath(org_file))
+    if idx is not None and (idx['size'], idx['mtime']) == (st.st_size, st.st_mtime_ns):
+        return idx['header'], pd.DataFrame(dict(enumerate(idx['columns'])), copy=True), idx['rows']
+    idx = None
+    save = False
+    if os.path.exists(idx_file):
+        try:
+            with open(idx_file, 'rb') as f:
+                idx = pickle.load(f)
+        except Exception:
+            idx = None
+    if idx is not None and (idx['size'], idx['mtime']) != (st.st_size, st.st_mtime_ns):
+        if idx['size'] != st.st_size or idx['hash'] != _file_hash(org_file):
+            idx = None
+        else:
+            # same content (e.g. touched or copied): keep the index, save the new mtime
+            idx['mtime'] = st.st_mtime_ns
+            save = True
+    if idx is None:
+        with open(org_file) as f:
+            header = [f.readline() for _ in range(3)]
+        df_riv = pd.read_csv(org_file, sep=r'\s+', skiprows=3, header=None)
+        idx = {
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'hash': _file_hash(org_file),
+            'header': header,
+            'columns': [df_riv[c].values for c in df_riv.columns],
+            'rows': {
+                -3: df_riv.groupby(df_riv.columns[-3]).indices,
+                -1: df_riv.groupby(df_riv.columns[-1]).indices,
+                }
+            }
+        save = True
+    if save:
+        with open(idx_file + '.tmp', 'wb') as f:
+            pickle.dump(idx, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(idx_file + '.tmp', idx_file)
+    _riv_packages[os.path.abspath(org_file)] = idx
+    df_riv = pd.DataFrame(dict(enumerate(idx['columns'])), copy=True)
+    return idx['header'], df_riv, idx['rows']
+
+
+def write_riv_package(riv_f, header, df_riv, sci_cols):
+    """write a river package (*.riv) file.
+
+    Args:
+        - riv_f (`str`): the path and name of the river package file to write
+        - header (`list`): lines written before the river cells
+        - df_riv (`pandas.DataFrame`): the river package cells
+        - sci_cols (`list`): positions of the columns written as '{:.10e}'
+    Note:
+        Columns are formatted as whole arrays and the file is written at once,
+        the result is the same as writing the formatted frame with a tab
+        separated `DataFrame.to_csv`.
+    """
+
+    ncols = len(df_riv.columns)
+    sci_cols = [c % ncols for c in sci_cols]
+    cols = []
+    for c in range(ncols):
+        values = df_riv.iloc[:, c].values
+        if c in sci_cols:
+            txt = np.char.mod('%.10e', values.astype(float))
+        else:
+            txt = values.astype(str)
+            if values.dtype.kind == 'f':
+                txt[np.isnan(values)] = ''
+        cols.append(txt.tolist())
+    with open(riv_f, 'w') as f:
+        f.write(''.join(header) + '\n'.join(map('\t'.join, zip(*cols))) + '\n')
+
+
+def apply_riv_pars(df_riv, riv_pars, riv_rows, cell_ids=False):
+    """apply river parameters to the conductance (5th column) and the river
+       bottom elevation (6th column) of the river cells.
+
+    Args:
+        - df_riv (`pandas.DataFrame`): the river package cells, changed in place
+        - riv_pars (`pandas.DataFrame`): river parameters from `read_modflow_par`
+        - riv_rows (`dict`): row positions of each cell id and channel/group
+            from `read_riv_package`
+        - cell_ids (`bool`, optional): if True, parameters whose channel number does
+            not start with 'g' refer to a cell id (third last column). Otherwise all
+            parameters refer to the channel/group in the last column. Defaults to False
+    Note:
+        Consecutive parameters of the same type and change type that touch
+        different cells are applied together, so thousands of cell-level
+        `rivcd_`/`rivbot_` parameters take a few array operations. The result
+        is the same as applying the parameters one by one in file order.
+    """
+
+    pars = []
+    for _, chg_type, val, par_type, chn_no in riv_pars.itertuples():
+        if par_type not in ('rivcd', 'rivbot'):
+            continue
+        if cell_ids and chn_no[0] != 'g':
+            rows = riv_rows[-3].get(int(chn_no))
+        else:
+            rows = riv_rows[-1].get(chn_no)
+        if rows is not None:
+            pars.append((par_type, chg_type, float(val), rows))
+
+    # group consecutive parameters of the same kind that change different cells
+    stamps = np.zeros(len(df_riv), dtype=int)
+    batches = []
+    for par_type, chg_type, val, rows in pars:
+        if (not batches or batches[-1][0] != (par_type, chg_type) or
+                (stamps[rows] == len(batches)).any()):
+            batches.append(((par_type, chg_type), [], []))
+        stamps[rows] = len(batches)
+        batches[-1][1].append(rows)
+        batches[-1][2].append(val)
+
+    rivcd = df_riv.iloc[:, 4].values.astype(float)
+    rivbot = df_riv.iloc[:, 5].values.astype(float)
+    for (par_type, chg_type), rows, vals in batches:
+        vals = np.repeat(vals, [len(x) for x in rows])
+        rows = np.concatenate(rows)
+        if par_type == 'rivcd':
+            if chg_type == 'pctchg':
+                rivcd[rows] = rivcd[rows] + (rivcd[rows] * vals / 100)
+            elif chg_type == 'unfchg':
+                rivcd[rows] = rivcd[rows] + vals
+            else:
+                rivcd[rows] = vals
+        else:
+            # NOTE: pctchg of rivbot is relative to the river conductance
+            if chg_type == 'pctchg':
+                rivbot[rows] = rivbot[rows] + (rivcd[rows] * vals / 100)
+            elif chg_type == 'unfchg':
+                rivbot[rows] = rivbot[rows] + vals
+            else:
+                rivbot[rows] = vals
+    df_riv.iloc[:, 4] = rivcd
+    df_riv.iloc[:, 5] = rivbot
+    return df_riv
+
+
+def riv_par(wd, cell_ids=False):
     """change river parameters in *.riv file (river package).
 
     Args:
         - wd (`str`): the path and name of the existing output file
+        - cell_ids (`bool`, optional): if True, parameters can refer to a cell id
+            or to a group ('g' prefix), see `riv_par_more_detail`. Defaults to False
     Reqs:
         - 'modflow.par'
     Opts:
@@ -76,68 +250,19 @@ def riv_par(wd):
         else:
             print('The "riv_package.org" file already exists...')
 
-        with open('riv_package.org') as f:
-            line1 = f.readline()
-            line2 = f.readline()
-            line3 = f.readline()
-
         # read riv pacakge
-        df_riv = pd.read_csv('riv_package.org', sep=r'\s+', skiprows=3, header=None)
+        header, df_riv, riv_rows = read_riv_package('riv_package.org')
 
         # read mf_riv_par.par
         riv_pars = read_modflow_par(wd)
-
-        # Select rows based on channel number
-        for i in range(len(riv_pars)):
-            if riv_pars.iloc[i, 2] == 'rivcd':
-                subdf = df_riv[df_riv.iloc[:, -1] == riv_pars.iloc[i, 3]]
-                if riv_pars.iloc[i, 0] == 'pctchg':
-                    new_rivcd = subdf.iloc[:, 4] + (subdf.iloc[:, 4] * float(riv_pars.iloc[i, 1]) / 100)
-                elif riv_pars.iloc[i, 0] == 'unfchg':
-                    new_rivcd = subdf.iloc[:, 4] + float(riv_pars.iloc[i, 1])
-                else:
-                    subdf.iloc[:, 4] = float(riv_pars.iloc[i, 1])
-                    new_rivcd = subdf.iloc[:, 4]
-                count = 0
-                for j in range(len(df_riv)):
-                    if df_riv.iloc[j, -1] == riv_pars.iloc[i, 3]:
-                        df_riv.iloc[j, 4] = new_rivcd.iloc[count]
-                        count += 1
-            elif riv_pars.iloc[i, 2] == 'rivbot':
-                subdf = df_riv[df_riv.iloc[:, -1] == riv_pars.iloc[i, 3]]
-                if riv_pars.iloc[i, 0] == 'pctchg':
-                    new_rivbot = subdf.iloc[:, 5] + (subdf.iloc[:, 4] * float(riv_pars.iloc[i, 1]) / 100)
-                elif riv_pars.iloc[i, 0] == 'unfchg':
-                    new_rivbot = subdf.iloc[:, 5] + float(riv_pars.iloc[i, 1])
-                else:
-                    subdf.iloc[:, 5] = float(riv_pars.iloc[i, 1])
-                    new_rivbot = subdf.iloc[:, 5]
-                count = 0
-                for j in range(len(df_riv)):
-                    if df_riv.iloc[j, -1] == riv_pars.iloc[i, 3]:
-                        df_riv.iloc[j, 5] = new_rivbot.iloc[count]
-                        count += 1
-
-        df_riv.iloc[:, 4] = df_riv.iloc[:, 4].map(lambda x: '{:.10e}'.format(x))
-        df_riv.iloc[:, 3] = df_riv.iloc[:, 3].map(lambda x: '{:.10e}'.format(x))
-        df_riv.iloc[:, 5] = df_riv.iloc[:, 5].map(lambda x: '{:.10e}'.format(x))
+        apply_riv_pars(df_riv, riv_pars, riv_rows, cell_ids=cell_ids)
 
         # ------------ Export Data to file -------------- #
         version = "version 1.2."
         time = datetime.now().strftime('- %m/%d/%y %H:%M:%S -')
-
-        with open(riv_f, 'w') as f:
-            f.write("# RIV: River package file is parameterized. " + version + time + "\n")
-            f.write(line1)
-            f.write(line2)
-            f.write(line3)
-            df_riv.to_csv(
-                        f, sep='\t',
-                        header=False,
-                        index=False,
-                        line_terminator='\n',
-                        encoding='utf-8'
-                        )
+        header = ["# RIV: River package file is parameterized. " + version + time + "\n"] + header
+        sci_cols = [3, 4, 5, -2] if cell_ids else [3, 4, 5]
+        write_riv_package(riv_f, header, df_riv, sci_cols=sci_cols)
         print(os.path.basename(riv_f) + " file is overwritten successfully!")
 
     elif len(riv_files) > 1:
@@ -150,7 +275,8 @@ def riv_par(wd):
 
 
 def riv_par_more_detail(wd):
-    """change river parameters in *.riv file (river package).
+    """change river parameters in *.riv file (river package) by cell ids
+       (e.g. 'rivcd_1024') or groups (e.g. 'rivcd_g1').
 
     Args:
         - wd (`str`): the path and name of the existing output file
@@ -164,130 +290,4 @@ def riv_par_more_detail(wd):
         - unfchg: provides uniform changes
     """
 
-    os.chdir(wd)
-    riv_files = [f for f in glob.glob(wd + "/*.riv")]
-    if len(riv_files) == 1:
-        riv_f = os.path.basename(riv_files[0])
-        # duplicate original riv file
-        if not os.path.exists('riv_package.org'):
-            shutil.copy(riv_f, 'riv_package.org')
-            print('The original river package "{}" has been backed up...'.format(riv_f))
-        else:
-            print('The "riv_package.org" file already exists...')
-
-        with open('riv_package.org') as f:
-            line1 = f.readline()
-            line2 = f.readline()
-            line3 = f.readline()
-
-        # read riv pacakge
-        df_riv = pd.read_csv('riv_package.org', sep=r'\s+', skiprows=3, header=None)
-
-        # read mf_riv_par.par
-        riv_pars = read_modflow_par(wd)
-
-        ''' this block used for whole change in river parameter
-        # Change river conductance
-        if riv_pars.loc['riv_cond', 'CHG_TYPE'].lower() == 'pctchg':
-            riv_cond_v = riv_pars.loc['riv_cond', 'VAL']
-            df_riv.iloc[:, 4] = df_riv.iloc[:, 4] + (df_riv.iloc[:, 4] * riv_cond_v / 100)
-        else:
-            riv_cond_v = riv_pars.loc['riv_cond', 'VAL']
-            df_riv.iloc[:, 4] = riv_cond_v
-
-        # Change river bottom elevation
-        riv_bot_v = riv_pars.loc['riv_bot', 'VAL']
-        if riv_pars.loc['riv_bot', 'CHG_TYPE'].lower() == 'pctchg':
-            df_riv.iloc[:, 5] = df_riv.iloc[:, 5] + (df_riv.iloc[:, 5] * riv_bot_v / 100)
-        elif riv_pars.loc['riv_bot', 'CHG_TYPE'].lower() == 'absval':
-            df_riv.iloc[:, 5] = riv_bot_v
-        else:
-            df_riv.iloc[:, 5] = df_riv.iloc[:, 5] + riv_bot_v
-
-        df_riv.iloc[:, 4] = df_riv.iloc[:, 4].map(lambda x: '{:.10e}'.format(x))
-        df_riv.iloc[:, 3] = df_riv.iloc[:, 3].map(lambda x: '{:.10e}'.format(x))
-        df_riv.iloc[:, 5] = df_riv.iloc[:, 5].map(lambda x: '{:.10e}'.format(x))
-        '''
-        # Select rows based on channel number
-        for i in range(len(riv_pars)):
-            if riv_pars.iloc[i, 2] == 'rivcd':
-                if riv_pars.iloc[i, 3][0] != 'g':
-                    subdf = df_riv[df_riv.iloc[:, -3] == int(riv_pars.iloc[i, 3])]
-                else:
-                    subdf = df_riv[df_riv.iloc[:, -1] == riv_pars.iloc[i, 3]]
-                if riv_pars.iloc[i, 0] == 'pctchg':
-                    new_rivcd = subdf.iloc[:, 4] + (subdf.iloc[:, 4] * float(riv_pars.iloc[i, 1]) / 100)
-                elif riv_pars.iloc[i, 0] == 'unfchg':
-                    new_rivcd = subdf.iloc[:, 4] + float(riv_pars.iloc[i, 1])
-                else:
-                    subdf.iloc[:, 4] = float(riv_pars.iloc[i, 1])
-                    new_rivcd = subdf.iloc[:, 4]
-                if riv_pars.iloc[i, 3][0] != 'g':         
-                    count = 0
-                    for j in range(len(df_riv)):
-                        if df_riv.iloc[j, -3] == int(riv_pars.iloc[i, 3]):
-                            df_riv.iloc[j, 4] = new_rivcd.iloc[count]
-                            count += 1
-                else:
-                    count = 0
-                    for j in range(len(df_riv)):
-                        if df_riv.iloc[j, -1] == riv_pars.iloc[i, 3]:
-                            df_riv.iloc[j, 4] = new_rivcd.iloc[count]
-                            count += 1                
-            elif riv_pars.iloc[i, 2] == 'rivbot':
-                if riv_pars.iloc[i, 3][0] != 'g':
-                    subdf = df_riv[df_riv.iloc[:, -3] == int(riv_pars.iloc[i, 3])]
-                else:
-                    subdf = df_riv[df_riv.iloc[:, -1] == riv_pars.iloc[i, 3]]
-                if riv_pars.iloc[i, 0] == 'pctchg':
-                    new_rivbot = subdf.iloc[:, 5] + (subdf.iloc[:, 4] * float(riv_pars.iloc[i, 1]) / 100)
-                elif riv_pars.iloc[i, 0] == 'unfchg':
-                    new_rivbot = subdf.iloc[:, 5] + float(riv_pars.iloc[i, 1])
-                else:
-                    subdf.iloc[:, 5] = float(riv_pars.iloc[i, 1])
-                    new_rivbot = subdf.iloc[:, 5]
-                if riv_pars.iloc[i, 3][0] != 'g':
-                    count = 0
-                    for j in range(len(df_riv)):
-                        if df_riv.iloc[j, -3] == int(riv_pars.iloc[i, 3]):
-                            df_riv.iloc[j, 5] = new_rivbot.iloc[count]
-                            count += 1
-                else:
-                    count = 0
-                    for j in range(len(df_riv)):
-                        if df_riv.iloc[j, -1] == riv_pars.iloc[i, 3]:
-                            df_riv.iloc[j, 5] = new_rivbot.iloc[count]
-                            count += 1
-                            
-        df_riv.iloc[:, 4] = df_riv.iloc[:, 4].map(lambda x: '{:.10e}'.format(x))
-        df_riv.iloc[:, 3] = df_riv.iloc[:, 3].map(lambda x: '{:.10e}'.format(x))
-        df_riv.iloc[:, 5] = df_riv.iloc[:, 5].map(lambda x: '{:.10e}'.format(x))
-        df_riv.iloc[:, -2] = df_riv.iloc[:, -2].map(lambda x: '{:.10e}'.format(x))
-
-        # ------------ Export Data to file -------------- #
-        version = "version 1.2."
-        time = datetime.now().strftime('- %m/%d/%y %H:%M:%S -')
-
-        with open(riv_f, 'w') as f:
-            f.write("# RIV: River package file is parameterized. " + version + time + "\n")
-            f.write(line1)
-            f.write(line2)
-            f.write(line3)
-            df_riv.to_csv(
-                        f, sep='\t',
-                        header=False,
-                        index=False,
-                        line_terminator='\n',
-                        encoding='utf-8'
-                        )
-        print(os.path.basename(riv_f) + " file is overwritten successfully!")
-
-    elif len(riv_files) > 1:
-        print(
-                "You have more than one River Package file!("+str(len(riv_files))+")"+"\n"
-                + str(riv_files)+"\n"
-                + "Solution: Keep only one file!")
-    else:
-        print("File Not Found! - We couldn't find your *.riv file.")
-
-
+    riv_par(wd, cell_ids=True)
@@ -0,0 +1,206 @@
+""" Per-stage timing of forward runs: each stage appends one json line with its
+    wall/CPU time, peak memory and bytes read/written to a log in the worker
+    directory; `summarize` collects the logs of all workers.
+
+    Example:
+        with sm_pst_prof.stage('model') as info:
+            run_model(...)
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+LOG_FILE = 'sm_pst_timing.log'
+
+
+def _proc_io():
+    # syscall level bytes of this process (Linux only)
+    io = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, val = line.split(':')
+                io[key] = int(val)
+    except (OSError, ValueError):
+        return None
+    return io.get('rchar', 0), io.get('wchar', 0)
+
+
+def _usage():
+    t = os.times()
+    usage = {
+        'wall': time.perf_counter(),
+        'cpu': t.user + t.system,
+        'cpu_children': t.children_user + t.children_system,
+        'io': _proc_io(),
+        }
+    if resource is not None:
+        ru_self = resource.getrusage(resource.RUSAGE_SELF)
+        ru_child = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # ru_maxrss is in bytes on macOS and in KB elsewhere
+        unit = 1 if sys.platform == 'darwin' else 1024
+        usage['rss'] = ru_self.ru_maxrss * unit
+        usage['rss_children'] = ru_child.ru_maxrss * unit
+        # block IO of the finished child processes (e.g. the model), in 512 byte blocks
+        usage['blocks_children'] = (ru_child.ru_inblock * 512, ru_child.ru_oublock * 512)
+    return usage
+
+
+@contextmanager
+def stage(name, log_file=LOG_FILE, wd=None, **info):
+    """time a stage of a forward run and append the record to the timing log.
+
+    Args:
+        - name (`str`): stage name, e.g. 'riv_par', 'model', 'extract'
+        - log_file (`str`, optional): the log file, relative to `wd`. If None,
+            nothing is recorded. Defaults to 'sm_pst_timing.log'
+        - wd (`str`, optional): worker directory. If None, the current
+            directory. Defaults to None
+        - info: other values written with the record
+    Note:
+        The `info` dictionary is yielded, so values known only at the end of
+        the stage can be added to the record.
+        A record has the keys: stage, start (unix time), wall, cpu, cpu_children (s),
+        max_rss_mb, max_rss_children_mb (peak of the process so far, MB),
+        read_mb, write_mb (this process and its finished children), status
+        and `info`. Values that are not available on the platform are null.
+    """
+
+    if log_file is None:
+        yield info
+        return
+    start = time.time()
+    before = _usage()
+    status = 'ok'
+    try:
+        yield info
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        after = _usage()
+        rec = {
+            'stage': name,
+            'start': round(start, 3),
+            'wall': round(after['wall'] - before['wall'], 4),
+            'cpu': round(after['cpu'] - before['cpu'], 4),
+            'cpu_children': round(after['cpu_children'] - before['cpu_children'], 4),
+            'max_rss_mb': None,
+            'max_rss_children_mb': None,
+            'read_mb': None,
+            'write_mb': None,
+            'status': status,
+            }
+        read = write = None
+        if after['io'] is not None and before['io'] is not None:
+            read = after['io'][0] - before['io'][0]
+            write = after['io'][1] - before['io'][1]
+        if 'rss' in after:
+            rec['max_rss_mb'] = round(after['rss'] / 2**20, 2)
+            rec['max_rss_children_mb'] = round(after['rss_children'] / 2**20, 2)
+            read = (read or 0) + after['blocks_children'][0] - before['blocks_children'][0]
+            write = (write or 0) + after['blocks_children'][1] - before['blocks_children'][1]
+        if read is not None:
+            rec['read_mb'] = round(read / 2**20, 3)
+            rec['write_mb'] = round(write / 2**20, 3)
+        rec.update(info)
+        with open(os.path.join(wd or os.getcwd(), log_file), 'a') as f:
+            f.write(json.dumps(rec) + '\n')
+
+
+def read_timing_log(log_file=LOG_FILE):
+    """read a timing log.
+
+    Args:
+        - log_file (`str`, optional): the path and name of the log.
+            Defaults to 'sm_pst_timing.log'
+
+    Returns:
+        `list`: records (dict)
+    """
+
+    recs = []
+    with open(log_file) as f:
+        for line in f:
+            try:
+                recs.append(json.loads(line))
+            except ValueError:
+                # partly written line of a killed run
+                continue
+    return recs
+
+
+def summarize(worker_root='..', pattern='worker_*', log_file=LOG_FILE, include_master=True):
+    """summarize the timing logs of all workers by stage.
+
+    Args:
+        - worker_root (`str`, optional): folder with the worker directories.
+            Defaults to '..'
+        - pattern (`str`, optional): worker directory names. Defaults to 'worker_*'
+        - log_file (`str`, optional): log file name. Defaults to 'sm_pst_timing.log'
+        - include_master (`bool`, optional): also read the log in `worker_root`.
+            Defaults to True
+
+    Example:
+        sm_pst_prof.summarize('D:/Projects/Watersheds/Animas/Analysis/APEX-MODFLOWs')
+
+    Returns:
+        `dataframe`: count, total/mean/max wall time, mean CPU time, max memory,
+        mean read/write MB and share of the total wall time of each stage, with
+        the slowest stage first
+    """
+
+    import pandas as pd
+
+    logs = sorted(glob.glob(os.path.join(worker_root, pattern, log_file)))
+    if include_master and os.path.exists(os.path.join(worker_root, log_file)):
+        logs.append(os.path.join(worker_root, log_file))
+    recs = []
+    for log in logs:
+        worker = os.path.basename(os.path.dirname(os.path.abspath(log)))
+        for rec in read_timing_log(log):
+            rec['worker'] = worker
+            recs.append(rec)
+    if not recs:
+        raise Exception("no timing logs found in '{}'".format(worker_root))
+    df = pd.DataFrame(recs)
+    for col in ['cpu_children', 'max_rss_mb', 'max_rss_children_mb', 'read_mb', 'write_mb']:
+        df[col] = pd.to_numeric(df[col])
+    df['cpu_total'] = df['cpu'] + df['cpu_children']
+    summary = df.groupby('stage').agg(
+        runs=('wall', 'size'),
+        workers=('worker', 'nunique'),
+        wall_total=('wall', 'sum'),
+        wall_mean=('wall', 'mean'),
+        wall_max=('wall', 'max'),
+        cpu_mean=('cpu_total', 'mean'),
+        max_rss_mb=('max_rss_mb', 'max'),
+        max_rss_children_mb=('max_rss_children_mb', 'max'),
+        read_mb_mean=('read_mb', 'mean'),
+        write_mb_mean=('write_mb', 'mean'),
+        errors=('status', lambda x: (x != 'ok').sum()),
+        )
+    summary['wall_pct'] = 100 * summary['wall_total'] / summary['wall_total'].sum()
+    summary = summary.sort_values('wall_total', ascending=False)
+    print(summary.round(3).to_string())
+    return summary
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    summarize(argv[0] if argv else '..')
+
+
+if __name__ == '__main__':
+    main()
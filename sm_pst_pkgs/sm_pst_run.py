@@ -0,0 +1,310 @@
+""" SWAT-MODFLOW forward run pipeline for PEST.
+
+    Importing this module does no work and imports no heavy packages;
+    pandas and the sm_pst_* modules are imported when a run starts.
+
+    Usage (e.g. as the model command line in the *.pst file):
+        python sm_pst_run.py forward_run.json
+"""
+
+import os
+import sys
+import json
+import subprocess
+from datetime import datetime
+
+
+# extractor function of each step in the "extract" section of the config
+EXTRACTORS = {
+    'rch': 'extract_month_str',
+    'sub': 'extract_month_baseflow',
+    'wt': 'extract_watertable_sim',
+    'cha': 'extract_month_avg',
+    }
+
+DEFAULTS = {
+    'riv_par': None,
+    'swat_edit': 'exe',
+    'model': None,
+    'extract': {},
+    'obs_file': None,
+    'max_workers': None,
+    'cache': None,
+    'timing_log': 'sm_pst_timing.log',
+    'watchdog': None,
+    }
+
+
+def read_config(config_file='forward_run.json'):
+    """read a forward run config file.
+
+    Args:
+        - config_file (`str`, optional): the path and name of the config file (json).
+            Defaults to 'forward_run.json'
+    Note:
+        Keys of the config file:
+        - riv_par (`str`): 'riv_par', 'riv_par_more_detail' or null to skip
+        - swat_edit (`str`): apply model.in to the SWAT inputs with 'exe' (Swat_Edit.exe)
+            or 'native' (`sm_pst_swat.swat_edit`, no hydrogrp/soltext/landuse/slope
+            filters, .gw/.hru/.sub/.rte/.mgt parameters only), or null to skip
+        - model (`str`): model executable, e.g. 'SWAT-MODFLOW3_fp_091120'
+        - extract (`dict`): keyword arguments of each extractor ('rch', 'sub', 'wt', 'cha')
+        - obs_file (`str`): if given, write all simulated values to this single file
+        - max_workers (`int`): threads used by the extractors
+        - cache (`dict`): run result cache, {"dir": "../run_cache", "max_mb": 2000,
+            "par_files": ["model.in", "mf_riv.par"]}; see `sm_pst_cache`
+        - timing_log (`str`): per-stage timing log in the working directory, or null
+            to skip; see `sm_pst_prof`
+        - watchdog (`dict`): stop a bad model run early and write penalty values,
+            {"max_wall": 7200, "stall": 600, "interval": 2, "penalty": 1e10,
+            "files": ["output.rch", "swatmf_out_MF_obs"]}; see `sm_pst_watch`
+
+    Example:
+        {
+            "riv_par": "riv_par",
+            "swat_edit": "exe",
+            "model": "SWAT-MODFLOW3_fp_091120",
+            "extract": {
+                "rch": {"rch_file": "output.rch", "channels": [225, 240], "start_day": "1/1/2003",
+                        "cali_start_day": "1/1/2003", "cali_end_day": "12/31/2007"},
+                "sub": {"sub_file": "output.sub", "channels": [66, 68, 147], "start_day": "1/1/2003",
+                        "cali_start_day": "1/1/2003", "cali_end_day": "12/31/2007"}
+                }
+        }
+
+    Returns:
+        `dict`: forward run config
+    """
+
+    with open(config_file) as f:
+        config = json.load(f)
+    return dict(DEFAULTS, **config)
+
+
+def worker_root(wd):
+    """the worker folder as the other programs know it.
+
+    Args:
+        - wd (`str`): working directory of the run (absolute)
+    Note:
+        In a worker folder staged in RAM (`sm_pst_workers.stage_workers_tmpfs`)
+        the current directory is the stage, not the worker folder link; its path
+        is read from 'worker_link.txt'.
+
+    Returns:
+        `str`: the worker folder
+    """
+
+    link_file = os.path.join(wd, 'worker_link.txt')
+    if os.path.exists(link_file):
+        with open(link_file) as f:
+            root = f.read().strip()
+        if os.path.realpath(root) == os.path.realpath(wd):
+            return root
+    return wd
+
+
+def _outside_path(root, path):
+    # relative paths that leave the worker folder are resolved from its link,
+    # not from the stage; paths inside stay relative
+    rel = os.path.normpath(path)
+    if os.path.isabs(path) or not (rel == os.pardir or rel.startswith(os.pardir + os.sep)):
+        return path
+    return os.path.normpath(os.path.join(root, path))
+
+
+def _banner(msg):
+    time = datetime.now().strftime('[%m/%d/%y %H:%M:%S]')
+    print('\n' + 30*'+ ')
+    print(time + ' | ' + msg)
+    print(30*'+ ' + '\n')
+
+
+def run_model(cmd, wd='.', watchdog=None):
+    """run the model executable and wait for it to finish.
+
+    Args:
+        - cmd (`str`): model executable (and arguments)
+        - wd (`str`, optional): working directory. Defaults to '.'
+        - watchdog (`dict`, optional): keyword arguments of `sm_pst_watch.run_watched`
+            to stop a bad run early. Defaults to None
+    Note:
+        Same behaviour as `pyemu.os_utils.run` without importing pyemu.
+
+    Returns:
+        `str`: why the watchdog stopped the run, or None
+
+    Raises:
+        Exception: the model returned a non-zero exit code
+    """
+
+    if watchdog is not None:
+        import sm_pst_watch
+        kwargs = {k: v for k, v in watchdog.items() if k != 'penalty'}
+        return sm_pst_watch.run_watched(cmd, wd, **kwargs)
+    exe = cmd.split()[0]
+    if os.name != 'nt' and os.path.exists(os.path.join(wd, exe)):
+        cmd = './' + cmd
+    ret = subprocess.call(cmd, shell=True, cwd=wd)
+    if ret != 0:
+        raise Exception("run() returned non-zero: {}".format(ret))
+    return None
+
+
+def update_pars(config, wd):
+    """apply the PEST parameter files (mf_riv.par, model.in) to the model inputs."""
+    from sm_pst_prof import stage
+
+    _banner('modifying SWAT parameters...')
+    if config['riv_par']:
+        with stage('riv_par', config['timing_log'], wd):
+            import sm_pst_par
+            getattr(sm_pst_par, config['riv_par'])(wd)
+    if config['swat_edit'] == 'native':
+        with stage('swat_edit', config['timing_log'], wd):
+            from sm_pst_swat import swat_edit
+            swat_edit(wd)
+    elif config['swat_edit'] in ('exe', True):
+        with stage('swat_edit', config['timing_log'], wd):
+            run_model('Swat_Edit.exe', wd)
+    elif config['swat_edit']:
+        raise Exception("unknown swat_edit '{}', use 'exe' or 'native'".format(config['swat_edit']))
+
+
+def extract_sims(config, wd):
+    """extract the simulated values of all steps in the "extract" section.
+
+    Returns:
+        `dict`: result of each step
+    """
+
+    import sm_pst_utils
+    from sm_pst_prof import stage
+
+    _banner('simulation successfully completed | extracting simulated values...')
+    os.chdir(wd)
+    single = config['obs_file'] is not None
+    steps = {}
+    for key, kwargs in config['extract'].items():
+        if key not in EXTRACTORS:
+            raise Exception("unknown extract step '{}'".format(key))
+        kwargs = dict(kwargs)
+        if single and key != 'cha':
+            kwargs['write_files'] = False
+        steps[key] = (getattr(sm_pst_utils, EXTRACTORS[key]), [], kwargs)
+    with stage('extract', config['timing_log'], wd) as info:
+        results, timings = sm_pst_utils.run_extractors(steps, max_workers=config['max_workers'])
+        info['steps'] = {key: round(t, 4) for key, t in timings.items()}
+        if single:
+            sm_pst_utils.write_sim_obs(
+                [results[key] for key in config['extract'] if key != 'cha'], config['obs_file'])
+    return results
+
+
+def output_files(config):
+    """list the simulated value files written by the "extract" section.
+
+    Returns:
+        `list`: output files relative to the working directory
+    """
+
+    if config['obs_file'] is not None:
+        files = [config['obs_file']]
+        if 'cha' in config['extract']:
+            kwargs = config['extract']['cha']
+            files += [
+                os.path.join(kwargs['cha_file'], 'cha_mon_avg_{:03d}.txt'.format(i))
+                for i in kwargs['channels']]
+        return files
+    files = []
+    for key, kwargs in config['extract'].items():
+        if key == 'rch':
+            files += ['cha_{:03d}.txt'.format(i) for i in kwargs['channels']]
+        elif key == 'sub':
+            files.append('baseflow_ratio.out')
+        elif key == 'wt':
+            files += ['wt_{}.txt'.format(i) for i in kwargs['grid_ids']]
+        elif key == 'cha':
+            files += [
+                os.path.join(kwargs['cha_file'], 'cha_mon_avg_{:03d}.txt'.format(i))
+                for i in kwargs['channels']]
+    return files
+
+
+def forward_run(config='forward_run.json', wd=None):
+    """run the parameter update, the model and the extraction of simulated values.
+
+    Args:
+        - config (`str` or `dict`, optional): config file or config dictionary,
+            see `read_config`. Defaults to 'forward_run.json'
+        - wd (`str`, optional): working directory. If None, the current
+            directory. Defaults to None
+
+    Note:
+        With a "cache" in the config, a run whose parameter files were already
+        run restores the cached outputs and skips the model.
+        With a "watchdog" in the config, a model run stopped early gets penalty
+        values in its simulated value files and is not cached.
+
+    Example:
+        sm_pst_run.forward_run('forward_run.json')
+    """
+
+    wd = os.path.abspath(wd or os.getcwd())
+    if isinstance(config, dict):
+        config = dict(DEFAULTS, **config)
+    else:
+        config = read_config(os.path.join(wd, config))
+    from sm_pst_prof import stage
+
+    # the cache key is the same in every worker
+    config_key = json.dumps(config, sort_keys=True)
+    root = worker_root(wd)
+    if root != wd and 'cha' in config['extract']:
+        cha = dict(config['extract']['cha'])
+        cha['cha_file'] = _outside_path(root, cha['cha_file'])
+        config['extract'] = dict(config['extract'], cha=cha)
+    cache = config['cache']
+    if cache:
+        import sm_pst_cache
+        cache_dir = os.path.join(wd, _outside_path(root, cache['dir']))
+        par_files = cache.get('par_files', ['model.in', 'mf_riv.par'])
+        # outputs outside the working directory cannot be cached: fail before the run
+        sm_pst_cache.entry_names(output_files(config), wd)
+        with stage('cache_restore', config['timing_log'], wd) as info:
+            key = sm_pst_cache.run_key(
+                            [os.path.join(wd, f) for f in par_files],
+                            extra=config_key)
+            restored = sm_pst_cache.restore_run(cache_dir, key, wd)
+            info['hit'] = restored is not None
+        if restored is not None:
+            _banner('same parameters found in the run cache | {} files restored...'.format(len(restored)))
+            return None
+    update_pars(config, wd)
+    if config.get('model'):
+        _banner('running model...')
+        with stage('model', config['timing_log'], wd) as info:
+            aborted = run_model(config['model'], wd, config['watchdog'])
+            if aborted is not None:
+                info['abort'] = aborted
+        if aborted is not None:
+            import sm_pst_watch
+            _banner('model run stopped | writing penalty values...')
+            sm_pst_watch.write_penalty(
+                output_files(config), wd, config['watchdog'].get('penalty', sm_pst_watch.PENALTY))
+            return None
+    results = extract_sims(config, wd)
+    if cache:
+        with stage('cache_store', config['timing_log'], wd):
+            os.makedirs(cache_dir, exist_ok=True)
+            sm_pst_cache.store_run(cache_dir, key, output_files(config), wd, max_mb=cache.get('max_mb'))
+    return results
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    forward_run(argv[0] if argv else 'forward_run.json')
+
+
+if __name__ == '__main__':
+    main()
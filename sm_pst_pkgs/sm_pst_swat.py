@@ -0,0 +1,269 @@
+""" Native SWAT parameter editor: applies 'model.in' to the SWAT text inputs
+    in place of Swat_Edit.exe ("swat_edit": "native" in the forward run config).
+    Only the parameters of the .gw/.hru/.sub/.rte/.mgt inputs and the subbasin
+    filter are supported; use Swat_Edit.exe for the others.
+"""
+
+import os
+import re
+import shutil
+import pickle
+import numpy as np
+
+
+SWAT_EXTS = ['gw', 'hru', 'sub', 'rte', 'mgt']
+
+# indexes already loaded by this process (e.g. sm_pst_daemon)
+_swat_indexes = {}
+
+
+def _swat_input_files(wd, exts):
+    pattern = re.compile(r'^\d{{9}}\.({})$'.format('|'.join(exts)))
+    return sorted(f for f in os.listdir(wd) if pattern.match(f))
+
+
+def _dir_signature(wd, files):
+    sig = []
+    for f in files:
+        st = os.stat(os.path.join(wd, f))
+        sig.append((f, st.st_size, st.st_mtime_ns))
+    return sig
+
+
+def _format_value(val, decimals, width):
+    # integer fields stay integers; others get as many significant digits as
+    # fit, so close parameter values (e.g. PEST perturbations) stay different
+    if decimals < 0:
+        return '{:d}'.format(int(round(val)))
+    for digits in range(10, 0, -1):
+        txt = '{:.{}g}'.format(val, digits)
+        if len(txt) < width:
+            return txt
+    return txt
+
+
+def read_model_in(model_in='model.in'):
+    """read a SWAT-CUP style parameter value file (model.in).
+
+    Args:
+        - model_in (`str`, optional): the path and name of the model.in file.
+            Defaults to 'model.in'
+    Note:
+        Parameter names follow 'x__NAME.ext__hydrogrp__soltext__landuse__subbsn__slope',
+        where 'x' is 'v' (replace), 'r' (relative change) or 'a' (add). Only the
+        subbasin filter (e.g. '1,3,10-12') is supported.
+
+    Returns:
+        `list`: (change type, parameter name, extension, subbasins or None, value)
+    """
+
+    pars = []
+    with open(model_in) as f:
+        for line in f:
+            items = line.split()
+            if not items or items[0].startswith('#'):
+                continue
+            parnme, val = items[0], float(items[1])
+            chg_type, rest = parnme[0].lower(), parnme[3:]
+            fields = rest.split('__')
+            name, ext = fields[0].rsplit('.', 1)
+            fields = fields[1:] + [''] * (5 - len(fields[1:]))
+            if any(fields[i] for i in (0, 1, 2, 4)):
+                raise Exception(
+                    "'{}': only the subbasin filter is supported by the native editor, "
+                    "use Swat_Edit.exe".format(parnme))
+            subs = None
+            if fields[3]:
+                subs = []
+                for item in fields[3].split(','):
+                    if '-' in item:
+                        first, last = item.split('-')
+                        subs.extend(range(int(first), int(last) + 1))
+                    else:
+                        subs.append(int(item))
+            if chg_type not in ('v', 'r', 'a'):
+                raise Exception("'{}': unknown change type '{}__'".format(parnme, chg_type))
+            pars.append((chg_type, name.upper(), ext.lower(), subs, val))
+    return pars
+
+
+def build_swat_index(wd, backup_dir='Backup', exts=None, idx_file='swat_edit.idx'):
+    """build (or load) the file/line index of the SWAT parameters in the original inputs.
+
+    Args:
+        - wd (`str`): SWAT (SWAT-MODFLOW) working directory
+        - backup_dir (`str`, optional): folder with the original SWAT inputs, relative
+            to `wd`. It is created from the current inputs if it does not exist.
+            Defaults to 'Backup'
+        - exts (`list`, optional): input file extensions to index. Defaults to SWAT_EXTS
+        - idx_file (`str`, optional): the index file, relative to `wd`.
+            Defaults to 'swat_edit.idx'
+    Note:
+        The index is rebuilt only when a file in `backup_dir` changed.
+
+    Returns:
+        `dict`: for each (NAME, ext), the files, line numbers, subbasins, original
+        values, value end positions and decimals, and the original line text
+    """
+
+    if exts is None:
+        exts = SWAT_EXTS
+    backup_dir = os.path.join(wd, backup_dir)
+    if not os.path.isdir(backup_dir):
+        os.makedirs(backup_dir)
+        for f in _swat_input_files(wd, exts):
+            shutil.copy2(os.path.join(wd, f), os.path.join(backup_dir, f))
+        print('The original SWAT inputs have been backed up to "{}"...'.format(backup_dir))
+    files = _swat_input_files(backup_dir, exts)
+    sig = _dir_signature(backup_dir, files)
+
+    idx_file = os.path.join(wd, idx_file)
+    idx = _swat_indexes.get(os.path.abspath(idx_file))
+    if idx is not None and idx['sig'] == sig:
+        return idx['pars']
+    if os.path.exists(idx_file):
+        try:
+            with open(idx_file, 'rb') as f:
+                idx = pickle.load(f)
+        except Exception:
+            # truncated or from another version: rebuild it
+            idx = None
+        if idx is not None and idx['sig'] == sig:
+            _swat_indexes[os.path.abspath(idx_file)] = idx
+            return idx['pars']
+
+    pars = {}
+    for fnam in files:
+        ext = fnam.rsplit('.', 1)[1]
+        sub = int(fnam[:5])
+        with open(os.path.join(backup_dir, fnam), newline='') as f:
+            for lineno, line in enumerate(f):
+                if '|' not in line or ':' not in line:
+                    continue
+                left, right = line.split('|', 1)
+                name = right.split(':', 1)[0].strip().upper()
+                try:
+                    val = float(left)
+                except ValueError:
+                    continue
+                token = left.strip()
+                decimals = len(token) - token.index('.') - 1 if '.' in token else -1
+                pars.setdefault((name, ext), []).append(
+                    (fnam, lineno, sub, val, len(left.rstrip()), decimals, line))
+    for key, entries in pars.items():
+        fnams, linenos, subs, vals, ends, decimals, lines = zip(*entries)
+        pars[key] = {
+            'files': list(fnams),
+            'lines': np.array(linenos),
+            'subs': np.array(subs),
+            'values': np.array(vals),
+            'ends': list(ends),
+            'decimals': list(decimals),
+            'text': list(lines),
+            }
+    idx = {'sig': sig, 'pars': pars}
+    with open(idx_file + '.tmp', 'wb') as f:
+        pickle.dump(idx, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(idx_file + '.tmp', idx_file)
+    _swat_indexes[os.path.abspath(idx_file)] = idx
+    return pars
+
+
+def swat_edit(
+            wd, model_in='model.in', backup_dir='Backup', exts=None,
+            idx_file='swat_edit.idx', state_file='swat_edit.state'):
+    """apply the parameter values in 'model.in' to the SWAT text inputs.
+
+    Args:
+        - wd (`str`): SWAT (SWAT-MODFLOW) working directory
+        - model_in (`str`, optional): parameter value file. Defaults to 'model.in'
+        - backup_dir (`str`, optional): folder with the original SWAT inputs.
+            Defaults to 'Backup'
+        - exts (`list`, optional): input file extensions. Defaults to SWAT_EXTS
+        - idx_file (`str`, optional): file/line index. Defaults to 'swat_edit.idx'
+        - state_file (`str`, optional): lines written by the last call.
+            Defaults to 'swat_edit.state'
+    Vars:
+        - v__: replaces the original value
+        - r__: changes the original value by a fraction, orig * (1 + val)
+        - a__: adds to the original value
+    Note:
+        Changes are always applied to the original values in `backup_dir`.
+        Only files whose lines differ from the last call are rewritten;
+        a file changed by another program is restored from `backup_dir` first.
+        Absolute parameter limits (Absolute_SWAT_Values.txt) are not checked.
+        Float values are written with up to 10 significant digits that fit the
+        original field.
+
+    Example:
+        sm_pst_swat.swat_edit('path')
+
+    Returns:
+        `list`: the rewritten files
+    """
+
+    index = build_swat_index(wd, backup_dir=backup_dir, exts=exts, idx_file=idx_file)
+
+    # new text of every line changed by model.in
+    new_lines = {}
+    for chg_type, name, ext, subs, val in read_model_in(os.path.join(wd, model_in)):
+        if (name, ext) not in index:
+            raise Exception(
+                "'{}.{}' not found in the {} files, use Swat_Edit.exe for it".format(
+                    name, ext, '/'.join('.' + x for x in (exts or SWAT_EXTS))))
+        entries = index[(name, ext)]
+        sel = np.arange(len(entries['files']))
+        if subs is not None:
+            sel = sel[np.isin(entries['subs'], subs)]
+        orgs = entries['values'][sel]
+        if chg_type == 'v':
+            news = np.full(len(sel), val)
+        elif chg_type == 'r':
+            news = orgs * (1 + val)
+        else:
+            news = orgs + val
+        for i, new in zip(sel, news):
+            text, end = entries['text'][i], entries['ends'][i]
+            txt = _format_value(new, entries['decimals'][i], end)
+            line = txt.rjust(end) + text[end:]
+            new_lines.setdefault(entries['files'][i], {})[int(entries['lines'][i])] = (line, text)
+
+    state_file = os.path.join(wd, state_file)
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+
+    rewritten = []
+    for fnam in sorted(set(new_lines) | set(state)):
+        fpath = os.path.join(wd, fnam)
+        lines = new_lines.get(fnam, {})
+        old = state.get(fnam)
+        st = os.stat(fpath)
+        intact = old is not None and old['sig'] == (st.st_size, st.st_mtime_ns)
+        if intact and old['lines'] == lines:
+            continue
+        if intact:
+            with open(fpath, newline='') as f:
+                content = f.readlines()
+            # restore lines that are no longer changed
+            for lineno, (_, text) in old['lines'].items():
+                content[lineno] = text
+        else:
+            with open(os.path.join(wd, backup_dir, fnam), newline='') as f:
+                content = f.readlines()
+        for lineno, (line, _) in lines.items():
+            content[lineno] = line
+        with open(fpath, 'w', newline='') as f:
+            f.write(''.join(content))
+        st = os.stat(fpath)
+        if lines:
+            state[fnam] = {'sig': (st.st_size, st.st_mtime_ns), 'lines': lines}
+        else:
+            state.pop(fnam, None)
+        rewritten.append(fnam)
+
+    with open(state_file, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    print('{} SWAT input files have been updated...'.format(len(rewritten)))
+    return rewritten
@@ -0,0 +1,304 @@
+""" Synthetic SWAT-MODFLOW model outputs for testing and benchmarking the
+    sm_pst_* utilities without running the model.
+
+    The files follow the layouts the sm_pst_* readers expect (column positions,
+    header lines, annual summary rows) with random values at a given size.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+
+def _fortran_e(vals, digits=5):
+    # Fortran E format without the leading zero, e.g. 40.1 -> '.40100E+02'
+    vals = np.asarray(vals, dtype=float)
+    exps = np.where(vals == 0, 0, np.floor(np.log10(np.abs(np.where(vals == 0, 1, vals)))) + 1)
+    mants = np.round(vals / 10.0**exps, digits)
+    # rounding up to 1.0
+    over = np.abs(mants) >= 1
+    mants[over] /= 10
+    exps[over] += 1
+    return [
+        '{}{}E{:+03d}'.format('-' if m < 0 else '', '{:.{}f}'.format(abs(m), digits)[1:], int(e))
+        for m, e in zip(mants, exps)]
+
+
+def _days(start_day, years):
+    start = pd.Timestamp(start_day)
+    return pd.date_range(start, start + pd.DateOffset(years=years), inclusive='left')
+
+
+def _time_steps(start_day, years, freq):
+    # (year, MON value) of each printed step, MON > 12 marks the annual summary rows
+    start = pd.Timestamp(start_day)
+    steps = []
+    for year in range(start.year, start.year + years):
+        if freq == 'M':
+            steps += [(year, m) for m in range(1, 13)] + [(year, year)]
+        elif freq == 'D':
+            steps += [(year, d) for d in range(1, pd.Timestamp(year, 12, 31).dayofyear + 1)]
+        else:
+            steps += [(year, year)]
+    return steps
+
+
+def write_output_rch(file_path='output.rch', n_reaches=100, start_day='1/1/2000', years=10,
+                     freq='M', n_vars=43, seed=0):
+    """write a synthetic SWAT output.rch file.
+
+    Args:
+        - file_path (`str`, optional): the path and name of the file. Defaults to 'output.rch'
+        - n_reaches (`int`, optional): number of reaches. Defaults to 100
+        - start_day ('str', optional): first printed day. Defaults to '1/1/2000'
+        - years (`int`, optional): number of printed years. Defaults to 10
+        - freq (`str`, optional): 'M' (monthly with annual summary rows),
+            'D' (daily) or 'A' (annual). Defaults to 'M'
+        - n_vars (`int`, optional): number of variables after AREAkm2 (FLOW_IN, FLOW_OUT, ...).
+            Defaults to 43
+        - seed (`int`, optional): random seed. Defaults to 0
+    Note:
+        Monthly files end with the average annual rows of every reach, MON = number of years.
+    """
+
+    rng = np.random.default_rng(seed)
+    areas = rng.uniform(1, 5000, n_reaches)
+    fmt = 'REACH {:4d} {:8d} {:5}' + '{:12.4E}' * (n_vars + 1) + '\n'
+    with open(file_path, 'w') as f:
+        f.write('\n SWAT synthetic output (sm_pst_synth)\n\n')
+        f.write(' General Input/Output section (file.cio):\n' + '\n' * 4)
+        f.write(
+            '      RCH      GIS   MON     AREAkm2  FLOW_INcms FLOW_OUTcms' +
+            ''.join('  VAR{:02d}     '.format(i) for i in range(3, n_vars + 1)) + '\n')
+        steps = _time_steps(start_day, years, freq)
+        if freq == 'M':
+            steps += [(None, '{:5.1f}'.format(years))]
+        for _, mon in steps:
+            vals = rng.gamma(2, 5, (n_reaches, n_vars))
+            f.write(''.join(
+                fmt.format(r + 1, 0, mon, areas[r], *vals[r]) for r in range(n_reaches)))
+
+
+def write_output_sub(file_path='output.sub', n_subs=100, start_day='1/1/2000', years=10,
+                     freq='M', n_vars=20, seed=0):
+    """write a synthetic SWAT output.sub file.
+
+    Args:
+        - file_path (`str`, optional): the path and name of the file. Defaults to 'output.sub'
+        - n_subs (`int`, optional): number of subbasins. Defaults to 100
+        - start_day ('str', optional): first printed day. Defaults to '1/1/2000'
+        - years (`int`, optional): number of printed years. Defaults to 10
+        - freq (`str`, optional): 'M', 'D' or 'A', see `write_output_rch`. Defaults to 'M'
+        - n_vars (`int`, optional): number of variables after AREAkm2, at least 16.
+            Defaults to 20
+        - seed (`int`, optional): random seed. Defaults to 0
+    Note:
+        As in SWAT, MON and AREAkm2 are printed without a space (e.g. '1.40100E+02'),
+        and GW_Q (column 11) is negative in a few percent of the rows.
+    """
+
+    rng = np.random.default_rng(seed)
+    areas = _fortran_e(rng.uniform(1, 500, n_subs))
+    fmt = 'BIGSUB{:4d} {:8d} {:4d}{}' + '{:10.3f}' * n_vars + '\n'
+    with open(file_path, 'w') as f:
+        f.write('\n SWAT synthetic output (sm_pst_synth)\n\n')
+        f.write(' General Input/Output section (file.cio):\n' + '\n' * 4)
+        f.write(
+            '      SUB      GIS  MON   AREAkm2' +
+            ''.join('  VAR{:02d}    '.format(i) for i in range(1, n_vars + 1)) + '\n')
+        for _, mon in _time_steps(start_day, years, freq):
+            vals = rng.gamma(1.5, 2, (n_subs, n_vars))
+            # GW_Qmm, token 11
+            vals[:, 7] -= 0.2
+            f.write(''.join(
+                fmt.format(s + 1, 0, mon, areas[s], *vals[s]) for s in range(n_subs)))
+
+
+def write_channel_day(file_path='channel_day.txt', n_channels=100, start_day='1/1/2000', years=10,
+                      n_vars=20, seed=0):
+    """write a synthetic SWAT+ channel_day.txt file.
+
+    Args:
+        - file_path (`str`, optional): the path and name of the file. Defaults to 'channel_day.txt'
+        - n_channels (`int`, optional): number of channels. Defaults to 100
+        - start_day ('str', optional): first printed day. Defaults to '1/1/2000'
+        - years (`int`, optional): number of printed years. Defaults to 10
+        - n_vars (`int`, optional): number of variables after flo_out. Defaults to 20
+        - seed (`int`, optional): random seed. Defaults to 0
+    """
+
+    rng = np.random.default_rng(seed)
+    dates = _days(start_day, years)
+    areas = rng.uniform(10, 50000, n_channels)
+    names = ['cha{:02d}'.format(i + 1) for i in range(n_channels)]
+    fmt = '{:6d}{:6d}{:6d}{:6d}{:9d}{:9d} {:>9s}{:14.3f}' + '{:14.5e}' * (n_vars + 1) + '\n'
+    with open(file_path, 'w') as f:
+        f.write('SWAT+ synthetic output (sm_pst_synth)\n')
+        f.write(
+            '  jday   mon   day    yr     unit   gis_id      name       area       flo_out' +
+            ''.join('      var{:02d}    '.format(i) for i in range(1, n_vars + 1)) + '\n')
+        f.write('                                                            ha        m^3/s\n')
+        for date in dates:
+            vals = rng.gamma(2, 5, (n_channels, n_vars + 1))
+            f.write(''.join(
+                fmt.format(date.dayofyear, date.month, date.day, date.year, c + 1, c + 1,
+                           names[c], areas[c], *vals[c])
+                for c in range(n_channels)))
+
+
+def write_mf_obs(wd='.', n_cells=50, start_day='1/1/2000', years=10, first_id=5000, seed=0):
+    """write synthetic modflow.obs and swatmf_out_MF_obs files (daily heads).
+
+    Args:
+        - wd (`str`, optional): folder to write to. Defaults to '.'
+        - n_cells (`int`, optional): number of observation cells. Defaults to 50
+        - start_day ('str', optional): first printed day. Defaults to '1/1/2000'
+        - years (`int`, optional): number of printed years. Defaults to 10
+        - first_id (`int`, optional): grid id of the first cell. Defaults to 5000
+        - seed (`int`, optional): random seed. Defaults to 0
+
+    Returns:
+        `list`: grid ids of the observation cells
+    """
+
+    rng = np.random.default_rng(seed)
+    grid_ids = list(range(first_id, first_id + n_cells * 7, 7))
+    elevs = rng.uniform(290, 330, n_cells)
+    with open(os.path.join(wd, 'modflow.obs'), 'w') as f:
+        f.write('# MODFLOW observation cells (sm_pst_synth)\n')
+        f.write('{} # number of cells\n'.format(n_cells))
+        for i, (gid, elev) in enumerate(zip(grid_ids, elevs)):
+            f.write('{} {} 1 {} {:.3f}\n'.format(i // 20 + 1, i % 20 + 1, gid, elev))
+    ndays = len(_days(start_day, years))
+    heads = elevs - rng.uniform(0.5, 20, n_cells) + rng.normal(0, 0.5, (ndays, n_cells)).cumsum(axis=0) * 0.05
+    with open(os.path.join(wd, 'swatmf_out_MF_obs'), 'w') as f:
+        f.write('Daily head values\n')
+        np.savetxt(f, heads, fmt='%.6f')
+    return grid_ids
+
+
+def write_riv(file_path='synth.riv', n_cells=10000, n_groups=20, seed=0):
+    """write a synthetic MODFLOW river package with cell ids and groups.
+
+    Args:
+        - file_path (`str`, optional): the path and name of the *.riv file.
+            Defaults to 'synth.riv'
+        - n_cells (`int`, optional): number of river cells. Defaults to 10000
+        - n_groups (`int`, optional): number of river groups ('g1', 'g2', ...). Defaults to 20
+        - seed (`int`, optional): random seed. Defaults to 0
+    Note:
+        Columns: layer, row, column, stage, conductance, river bottom, cell id,
+        river length and group, after 3 header lines.
+    """
+
+    rng = np.random.default_rng(seed)
+    ncol = int(np.ceil(np.sqrt(n_cells)))
+    bots = rng.uniform(280, 320, n_cells)
+    stages = bots + rng.uniform(0.1, 3, n_cells)
+    conds = rng.lognormal(3, 1, n_cells)
+    lens = np.round(rng.uniform(10, 500, n_cells), 3)
+    groups = rng.integers(1, n_groups + 1, n_cells)
+    with open(file_path, 'w') as f:
+        f.write('# RIV: River package file (sm_pst_synth)\n')
+        f.write('{:10d}{:10d}\n'.format(n_cells, 0))
+        f.write('{:10d}{:10d}\n'.format(n_cells, 0))
+        f.write(''.join(
+            '1 {} {} {:.10e} {:.10e} {:.10e} {} {} g{}\n'.format(
+                i // ncol + 1, i % ncol + 1, stages[i], conds[i], bots[i], i + 1, lens[i], groups[i])
+            for i in range(n_cells)))
+
+
+def write_mf_riv_par(file_path='mf_riv.par', n_groups=20, cell_ids=None, seed=0):
+    """write a mf_riv.par file with a conductance and a river bottom parameter per group.
+
+    Args:
+        - file_path (`str`, optional): the path and name of the file. Defaults to 'mf_riv.par'
+        - n_groups (`int`, optional): number of river groups. Defaults to 20
+        - cell_ids (`list`, optional): cell ids with their own parameters
+            (for `riv_par_more_detail`). Defaults to None
+        - seed (`int`, optional): random seed. Defaults to 0
+    """
+
+    rng = np.random.default_rng(seed)
+    chg_types = ['pctchg', 'unfchg', 'absval']
+    # value range of each change type
+    ranges = {
+        'rivcd': {'pctchg': (-50, 50), 'unfchg': (-5, 5), 'absval': (1, 100)},
+        'rivbot': {'pctchg': (-2, 2), 'unfchg': (-1, 1), 'absval': (280, 320)},
+        }
+    pars = []
+    for g in range(1, n_groups + 1):
+        for par_type, chg_type in [('rivcd', chg_types[g % 3]), ('rivbot', chg_types[(g + 1) % 3])]:
+            val = rng.uniform(*ranges[par_type][chg_type])
+            pars.append(('{}_g{}'.format(par_type, g), chg_type, round(val, 4)))
+    for i in cell_ids or []:
+        pars.append(('rivcd_{}'.format(i), 'absval', round(rng.uniform(1, 100), 4)))
+    with open(file_path, 'w') as f:
+        f.write('# modflow_par file.\n')
+        f.write('NAME   CHG_TYPE    VAL\n')
+        f.write(''.join('{} {} {}\n'.format(*p) for p in pars))
+
+
+def write_obd(file_path, col_names, start_day, end_day, freq='M', missing=0.2, seed=0):
+    """write a synthetic observation file (streamflow.obd, modflow.obd).
+
+    Args:
+        - file_path (`str`): the path and name of the file
+        - col_names (`list`): observation columns, e.g. ['sub009', 'sub060']
+        - start_day ('str'): first observation day
+        - end_day ('str'): last observation day
+        - freq (`str`, optional): 'M' for month ends or 'D' for days. Defaults to 'M'
+        - missing (`float`, optional): fraction of empty or -999 values. Defaults to 0.2
+        - seed (`int`, optional): random seed. Defaults to 0
+    """
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start_day, end_day, freq=freq)
+    vals = np.char.mod('%.3f', rng.gamma(2, 2, (len(dates), len(col_names))))
+    miss = rng.random(vals.shape) < missing
+    vals[miss] = np.where(rng.random(miss.sum()) < 0.5, '', '-999')
+    with open(file_path, 'w') as f:
+        f.write('\t'.join(['date'] + list(col_names)) + '\n')
+        f.write(''.join(
+            '\t'.join([d] + row) + '\n'
+            for d, row in zip(dates.strftime('%m/%d/%Y'), vals.tolist())))
+
+
+def make_case(wd, n_reaches=100, n_subs=None, n_channels=None, years=10, freq='M',
+              start_day='1/1/2000', n_obs_cells=50, n_riv_cells=10000, n_riv_groups=20, seed=0):
+    """write a complete synthetic SWAT-MODFLOW working directory.
+
+    Args:
+        - wd (`str`): folder to write to, created if it does not exist
+        - n_reaches (`int`, optional): reaches in output.rch. Defaults to 100
+        - n_subs (`int`, optional): subbasins in output.sub. If None, `n_reaches`
+        - n_channels (`int`, optional): channels in channel_day.txt. If None, `n_reaches`
+        - years (`int`, optional): simulated years. Defaults to 10
+        - freq (`str`, optional): printing frequency of output.rch/output.sub. Defaults to 'M'
+        - start_day ('str', optional): simulation start day. Defaults to '1/1/2000'
+        - n_obs_cells (`int`, optional): MODFLOW observation cells. Defaults to 50
+        - n_riv_cells (`int`, optional): river cells. Defaults to 10000
+        - n_riv_groups (`int`, optional): river groups. Defaults to 20
+        - seed (`int`, optional): random seed. Defaults to 0
+
+    Example:
+        sm_pst_synth.make_case('synth', n_reaches=500, years=30, n_riv_cells=50000)
+
+    Returns:
+        `dict`: the sizes and the grid ids of the observation cells
+    """
+
+    os.makedirs(wd, exist_ok=True)
+    n_subs = n_reaches if n_subs is None else n_subs
+    n_channels = n_reaches if n_channels is None else n_channels
+    write_output_rch(os.path.join(wd, 'output.rch'), n_reaches, start_day, years, freq, seed=seed)
+    write_output_sub(os.path.join(wd, 'output.sub'), n_subs, start_day, years, freq, seed=seed)
+    write_channel_day(os.path.join(wd, 'channel_day.txt'), n_channels, start_day, years, seed=seed)
+    grid_ids = write_mf_obs(wd, n_obs_cells, start_day, years, seed=seed)
+    write_riv(os.path.join(wd, 'synth.riv'), n_riv_cells, n_riv_groups, seed=seed)
+    write_mf_riv_par(os.path.join(wd, 'mf_riv.par'), n_riv_groups, seed=seed)
+    print('Synthetic SWAT-MODFLOW files have been written to "{}"...'.format(wd))
+    return {
+        'n_reaches': n_reaches, 'n_subs': n_subs, 'n_channels': n_channels, 'years': years,
+        'freq': freq, 'start_day': start_day, 'grid_ids': grid_ids,
+        'n_riv_cells': n_riv_cells, 'n_riv_groups': n_riv_groups}
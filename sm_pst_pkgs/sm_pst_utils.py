@@ -5,15 +5,105 @@
 import pandas as pd
 import numpy as np
 import time
-from pyemu.pst.pst_utils import SFMT,IFMT,FFMT
 import os
+import re
 import shutil
-import socket
-import multiprocessing as mp
 import csv
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
+# NOTE: pyemu, socket and multiprocessing are imported where they are used
+# to keep the import of this module light for every forward run.
 
-def extract_month_str(rch_file, channels, start_day, cali_start_day, cali_end_day):
+
+# date indexes and observation names are the same in every run of a config,
+# so a long-running process (e.g. sm_pst_daemon) builds them only once
+@lru_cache(maxsize=64)
+def _date_index(start_day, end_day=None, freq='D', periods=None):
+    return pd.date_range(start_day, end_day, periods=periods, freq=freq)
+
+
+@lru_cache(maxsize=256)
+def _date_names(start_day, end_day, freq, fmt):
+    return _date_index(start_day, end_day, freq).strftime(fmt)
+
+
+# modflow.obs files already read by this process
+_mf_obs = {}
+
+
+def _read_mf_obs(obs_file='modflow.obs'):
+    st = os.stat(obs_file)
+    key = os.path.abspath(obs_file)
+    cached = _mf_obs.get(key)
+    if cached is not None and cached[0] == (st.st_size, st.st_mtime_ns):
+        return cached[1]
+    df = pd.read_csv(obs_file, sep=r'\s+', usecols=[3, 4], skiprows=2, header=None)
+    _mf_obs[key] = ((st.st_size, st.st_mtime_ns), df)
+    return df
+
+
+def read_swat_output(
+                out_file, ids, usecols, names, start_day, cali_start_day, cali_end_day,
+                row_filter=None, freq='M', chunksize=100000):
+    """stream a SWAT output file (e.g. output.rch, output.sub) in chunks and keep
+       only the requested ids, columns and calibration period.
+
+    Args:
+        - out_file (`str`): the path and name of the existing output file
+        - ids (`list`): reach or subbasin numbers in a list, e.g. [9, 60]
+        - usecols (`list`): column positions to read, the first one is the id column
+        - names (`list`): column names for `usecols`
+        - start_day ('str'): simulation start day after warm period, e.g. '1/1/1985'
+        - cali_start_day ('str'): calibration start day e.g. '1/1/1993'
+        - cali_end_day ('str'): calibration end day e.g. '12/31/2000'
+        - row_filter (`callable`, optional): returns a boolean mask of the rows in a
+            chunk that are time steps (e.g. to drop annual summary rows). Defaults to None
+        - freq (`str`, optional): printing frequency of the output file. Defaults to 'M'
+        - chunksize (`int`, optional): number of lines read at a time. Defaults to 100000
+
+    Note:
+        Reading stops once every requested id has passed `cali_end_day`, so memory
+        use depends on the calibration period rather than the size of the file.
+
+    Example:
+        sm_pst_utils.read_swat_output(
+            'output.rch', [9, 60], [1, 3, 6], ['rch', 'filter', 'str_sim'],
+            '1/1/1993', '1/1/1993', '12/31/2000', row_filter=lambda df: df['filter'] < 13)
+
+    Returns:
+        `pandas.DataFrame`: rows of the calibration period indexed by id with a `date` column
+    """
+
+    dates = _date_index(start_day, cali_end_day, freq=freq)
+    first = int((dates < pd.Timestamp(cali_start_day)).sum())
+    last = len(dates)
+    # number of time steps already read for each id
+    counts = pd.Series(0, index=pd.Index(ids).unique())
+
+    sim_dfs = []
+    with pd.read_csv(
+                    out_file,
+                    delim_whitespace=True,
+                    skiprows=9,
+                    usecols=usecols,
+                    names=names,
+                    index_col=0,
+                    chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk = chunk[chunk.index.isin(counts.index)]
+            if row_filter is not None:
+                chunk = chunk[row_filter(chunk).values]
+            steps = chunk.groupby(level=0).cumcount().values + counts.reindex(chunk.index).values
+            counts = counts.add(chunk.index.value_counts(), fill_value=0).astype(int)
+            keep = (steps >= first) & (steps < last)
+            sim_dfs.append(chunk[keep].assign(date=dates[steps[keep]]))
+            if counts.min() >= last:
+                break
+    return pd.concat(sim_dfs)
+
+
+def extract_month_str(rch_file, channels, start_day, cali_start_day, cali_end_day, write_files=True):
     """extract a simulated streamflow from the output.rch file,
        store it in each channel file.
 
@@ -22,31 +112,45 @@ def extract_month_str(rch_file, channels, start_day, cali_start_day, cali_end_da
         - channels (`list`): channel number in a list, e.g. [9, 60]
         - start_day ('str'): simulation start day after warm period, e.g. '1/1/1985'
         - end_day ('str'): simulation end day e.g. '12/31/2005'
+        - write_files (`bool`, optional): write the cha_XXX.txt files. Defaults to True
+
+    Note:
+        output.rch is streamed once with `read_swat_output`; only the requested
+        channels and the calibration period are kept.
 
     Example:
         sm_pst_utils.extract_month_str('path', [9, 60], '1/1/1993', '1/1/1993', '12/31/2000')
+
+    Returns:
+        `pandas.Series`: simulated streamflow by observation name, e.g. 'cha009_199301'
     """
 
+    sim_stf = read_swat_output(
+                    rch_file, channels,
+                    usecols=[1, 3, 6],
+                    names=["rch", "filter", "str_sim"],
+                    start_day=start_day,
+                    cali_start_day=cali_start_day,
+                    cali_end_day=cali_end_day,
+                    row_filter=lambda df: df['filter'] < 13)
+    sim_stfs = sim_stf.groupby(level=0)
+    dates = _date_index(start_day, cali_end_day, freq='M')
+
+    sims = []
     for i in channels:
-        sim_stf = pd.read_csv(
-                        rch_file,
-                        delim_whitespace=True,
-                        skiprows=9,
-                        usecols=[1, 3, 6],
-                        names=["date", "filter", "str_sim"],
-                        index_col=0)
-
-        sim_stf_f = sim_stf.loc[i]
-        sim_stf_f = sim_stf_f[sim_stf_f['filter'] < 13]
-        sim_stf_f = sim_stf_f.drop(['filter'], axis=1)
-        sim_stf_f.index = pd.date_range(start_day, periods=len(sim_stf_f.str_sim), freq='M')
-        sim_stf_f = sim_stf_f[cali_start_day:cali_end_day]
-        sim_stf_f.to_csv('cha_{:03d}.txt'.format(i), sep='\t', encoding='utf-8', index=True, header=False, float_format='%.7e')
-        print('cha_{:03d}.txt file has been created...'.format(i))
+        sim_stf_f = sim_stfs.get_group(i).set_index('date').loc[:, ['str_sim']]
+        if write_files:
+            sim_stf_f.to_csv('cha_{:03d}.txt'.format(i), sep='\t', encoding='utf-8', index=True, header=False, float_format='%.7e')
+            print('cha_{:03d}.txt file has been created...'.format(i))
+        names = _date_names(start_day, cali_end_day, 'M', 'cha{:03d}_%Y%m'.format(i))
+        sims.append(pd.Series(
+                        sim_stf_f['str_sim'].values,
+                        index=names[dates.get_indexer(sim_stf_f.index)]))
     print('Finished ...')
+    return pd.concat(sims)
 
 
-def extract_month_baseflow(sub_file, channels, start_day, cali_start_day, cali_end_day):
+def extract_month_baseflow(sub_file, channels, start_day, cali_start_day, cali_end_day, write_files=True):
     """ extract a simulated baseflow rates from the output.sub file,
         store it in each channel file.
 
@@ -55,91 +159,102 @@ def extract_month_baseflow(sub_file, channels, start_day, cali_start_day, cali_e
         - channels (`list`): channel number in a list, e.g. [9, 60]
         - start_day ('str'): simulation start day after warm period, e.g. '1/1/1985'
         - end_day ('str'): simulation end day e.g. '12/31/2005'
+        - write_files (`bool`, optional): write the baseflow_ratio.out file. Defaults to True
+
+    Note:
+        output.sub is streamed once with `read_swat_output`; the monthly baseflow
+        ratios of all requested subbasins are calculated together.
 
     Example:
         sm_pst_utils.extract_month_baseflow('path', [9, 60], '1/1/1993', '1/1/1993', '12/31/2000')
+
+    Returns:
+        `pandas.Series`: average baseflow ratio by observation name, e.g. 'bfr_009'
     """
-    gwqs = []
-    subs = []
-    for i in channels:
-        sim_stf = pd.read_csv(
-                        sub_file,
-                        delim_whitespace=True,
-                        skiprows=9,
-                        usecols=[1, 3, 10, 11, 19],
-                        names=["date", "filter", "surq", "gwq", "latq"],
-                        index_col=0)
-        
-        sim_stf_f = sim_stf.loc[i]
-        # sim_stf_f["filter"]= sim_stf_f["filter"].astype(str) 
-        sim_stf_f = sim_stf_f[sim_stf_f['filter'].astype(str).map(len) < 13]
-        sim_stf_f = sim_stf_f.drop(['filter'], axis=1)
-        sim_stf_f.index = pd.date_range(start_day, periods=len(sim_stf_f.surq), freq='M')
-        sim_stf_f = sim_stf_f[cali_start_day:cali_end_day]
-        # sim_stf_f.to_csv('gwq_{:03d}.txt'.format(i), sep='\t', encoding='utf-8', index=True, header=False, float_format='%.7e')
-        
-        sim_stf_f['surq'] = sim_stf_f['surq'].astype(float)
-        sim_stf_f['bf_rate'] = sim_stf_f['gwq']/ (sim_stf_f['surq'] + sim_stf_f['latq'] + sim_stf_f['gwq'])
-        sim_stf_f.loc[sim_stf_f['gwq'] < 0, 'bf_rate'] = 0     
-        bf_rate = sim_stf_f['bf_rate'].mean()
-        # bf_rate = bf_rate.item()
-        subs.append('bfr_{:03d}'.format(i))
-        gwqs.append(bf_rate)
-        print('Average baseflow rate for {:03d} has been calculated ...'.format(i))
-    # Combine lists into array
-    bfr_f = np.c_[subs, gwqs]
-    with open('baseflow_ratio.out', "w", newline='') as f:
-        writer = csv.writer(f, delimiter='\t')
-        for item in bfr_f:
-            writer.writerow([(item[0]),
-                '{:.4f}'.format(float(item[1]))
-                ])
+
+    sim_stf = read_swat_output(
+                    sub_file, channels,
+                    usecols=[1, 3, 10, 11, 19],
+                    names=["sub", "filter", "surq", "gwq", "latq"],
+                    start_day=start_day,
+                    cali_start_day=cali_start_day,
+                    cali_end_day=cali_end_day,
+                    row_filter=lambda df: df['filter'].astype(str).map(len) < 13)
+
+    surq = sim_stf['surq'].astype(float)
+    bf_rate = sim_stf['gwq'] / (surq + sim_stf['latq'] + sim_stf['gwq'])
+    bf_rate = bf_rate.mask(sim_stf['gwq'] < 0, 0)
+    bf_rate = bf_rate.groupby(level=0).mean().reindex(channels)
+    bf_rate.index = ['bfr_{:03d}'.format(i) for i in channels]
+    print('Average baseflow rates for {} subbasins have been calculated ...'.format(len(channels)))
+
+    if write_files:
+        with open('baseflow_ratio.out', "w", newline='') as f:
+            writer = csv.writer(f, delimiter='\t')
+            writer.writerows(zip(bf_rate.index, ['{:.4f}'.format(i) for i in bf_rate.values]))
     print('Finished ...\n')
+    return bf_rate
 
 
-def extract_watertable_sim(grid_ids, start_day, end_day):
-    """extract a simulated streamflow from the output.rch file,
-        store it in each channel file.
+def extract_watertable_sim(grid_ids, start_day, end_day, dtype=np.float64, write_files=True):
+    """extract a simulated depth to water table from the swatmf_out_MF_obs file,
+        store it in each grid file.
 
     Args:
-        - rch_file (`str`): the path and name of the existing output file
-        - channels (`list`): channel number in a list, e.g. [9, 60]
+        - grid_ids (`list`): modflow grid ids in a list, e.g. [5699, 5832]
         - start_day ('str'): simulation start day after warm period, e.g. '1/1/1985'
         - end_day ('str'): simulation end day e.g. '12/31/2000'
+        - dtype (`numpy.dtype`, optional): dtype used to parse the simulated heads.
+            Defaults to numpy.float64
+        - write_files (`bool`, optional): write the wt_<id>.txt files. Defaults to True
+
+    Note:
+        Only the requested grid columns and the days up to `end_day` are parsed.
+        `dtype=numpy.float32` parses faster and uses half the memory, but keeps
+        only about 7 significant digits of the heads (about 3e-5 m at 300 m),
+        which is as small as the head changes of the parameter perturbations
+        of a Jacobian run; use it only when the heads are not calibrated on
+        (e.g. quick checks).
 
     Example:
-        pest_utils.extract_month_str('path', [9, 60], '1/1/1993', '12/31/2000')
+        pest_utils.extract_watertable_sim([5699, 5832], '1/1/1993', '12/31/2000')
+
+    Returns:
+        `pandas.Series`: simulated depth to water table by observation name, e.g. 'wt5699_19930101'
     """
     if not os.path.exists('swatmf_out_MF_obs'):
         raise Exception("'swatmf_out_MF_obs' file not found")
     if not os.path.exists('modflow.obs'):
         raise Exception("'modflow.obs' file not found")
-    mf_obs_grid_ids = pd.read_csv(
-                        'modflow.obs',
-                        sep=r'\s+',
-                        usecols=[3, 4],
-                        skiprows=2,
-                        header=None
-                        )
+    mf_obs_grid_ids = _read_mf_obs('modflow.obs')
     col_names = mf_obs_grid_ids.iloc[:, 0].tolist()
+    cols = [col_names.index(i) for i in grid_ids]
 
-    # set index by modflow grid ids
-    mf_obs_grid_ids = mf_obs_grid_ids.set_index([3])
+    # use land surface elevation to get depth to water
+    elevs = mf_obs_grid_ids.iloc[cols, 1].values.astype(float)
 
+    dates = _date_index(start_day, end_day)
     mf_sim = pd.read_csv(
-                        'swatmf_out_MF_obs', skiprows=1, sep=r'\s+',
-                        names=col_names,
-                        usecols=grid_ids,
-                        )
-    mf_sim.index = pd.date_range(start_day, periods=len(mf_sim))
-    mf_sim = mf_sim[start_day:end_day]
-    for i in grid_ids:
-        elev = mf_obs_grid_ids.loc[i].values  # use land surface elevation to get depth to water
-        (mf_sim.loc[:, i] - elev).to_csv(
-                        'wt_{}.txt'.format(i), sep='\t', encoding='utf-8',
-                        index=True, header=False, float_format='%.7e'
+                        'swatmf_out_MF_obs', skiprows=1, delim_whitespace=True,
+                        header=None,
+                        usecols=cols,
+                        nrows=len(dates),
+                        dtype=dtype,
                         )
-        print('wt_{}.txt file has been created...'.format(i))
+    wts = mf_sim.loc[:, cols].values - elevs
+    n = len(wts)
+    if write_files:
+        days = _date_names(start_day, end_day, 'D', '%Y-%m-%d')[:n].tolist()
+        for i, wt in zip(grid_ids, wts.T):
+            wt = np.char.mod('%.7e', wt)
+            wt[wt == 'nan'] = ''
+            with open('wt_{}.txt'.format(i), 'w', encoding='utf-8') as f:
+                f.write(''.join(map('{}\t{}\n'.format, days, wt.tolist())))
+            print('wt_{}.txt file has been created...'.format(i))
+    return pd.Series(
+                    wts.T.ravel(),
+                    index=np.concatenate([
+                        _date_names(start_day, end_day, 'D', 'wt{}_%Y%m%d'.format(i))[:n] for i in grid_ids]))
 
 
 def str_obd_to_ins(srch_file, col_name, start_day, end_day):
@@ -239,47 +354,324 @@ def mf_obd_to_ins(wt_file, col_name, start_day, end_day):
     return result['{}_ins'.format(col_name)]
 
 
+def _read_obd(obd_file, start_day, end_day, cols=None):
+    # observation columns of an *.obd file in the calibration period; empty and
+    # -999 values are NaN (no measured data)
+    obd = pd.read_csv(
+                    obd_file,
+                    sep='\t',
+                    usecols=None if cols is None else ['date'] + list(cols),
+                    index_col=0,
+                    parse_dates=True,
+                    na_values=[-999, '']
+                    )
+    return obd[start_day:end_day]
+
+
+def obd_to_ins_batch(obd_file, sim_files, start_day, end_day, date_fmt):
+    """write the instruction files of all observation columns of an *.obd file.
+
+    Args:
+        - obd_file (`str`): the path and name of the observation file, e.g. 'streamflow.obd'
+        - sim_files (`dict`): simulation file of each observation column,
+            e.g. {'sub009': 'cha_009.txt', 'sub060': 'cha_060.txt'}
+        - start_day ('str'): calibration start day, e.g. '1/1/1993'
+        - end_day ('str'): calibration end day e.g. '12/31/2000'
+        - date_fmt ('str'): date format of the observation names, e.g. '%Y%m'
+    Note:
+        The *.obd file is read once; empty and -999 values are skipped ('l1').
+
+    Returns:
+        `dict`: instructions of each observation column
+    """
+
+    obd = _read_obd(obd_file, start_day, end_day, sim_files)
+    results = {}
+    for col_name, sim_file in sim_files.items():
+        sim = pd.read_csv(
+                        sim_file,
+                        delim_whitespace=True,
+                        names=["date", "str_sim"],
+                        index_col=0,
+                        parse_dates=True)
+        result = pd.concat([obd[col_name], sim], axis=1)[col_name]
+        ins = pd.DatetimeIndex(result.index).strftime('l1 w !{}_{}!'.format(col_name, date_fmt))
+        ins = np.where(result.isnull(), 'l1', ins)
+        with open(sim_file + '.ins', "w", newline='') as f:
+            f.write("pif ~\n" + "\n".join(ins) + "\n")
+        print('{}.ins file has been created...'.format(sim_file))
+        results[col_name] = pd.Series(ins, index=result.index, name='{}_ins'.format(col_name))
+    return results
+
+
+def str_obd_to_ins_batch(sim_files, start_day, end_day):
+    """write the instruction files of the simulated monthly streamflow of all
+       gauges in 'streamflow.obd'.
+
+    Args:
+        - sim_files (`dict`): simulation file of each gauge,
+            e.g. {'sub009': 'cha_009.txt', 'sub060': 'cha_060.txt'}
+        - start_day ('str'): calibration start day, e.g. '1/1/1993'
+        - end_day ('str'): calibration end day e.g. '12/31/2000'
+
+    Example:
+        sm_pst_utils.str_obd_to_ins_batch({'sub009': 'cha_009.txt'}, '1/1/1993', '12/31/2000')
+    """
+
+    return obd_to_ins_batch('streamflow.obd', sim_files, start_day, end_day, '%Y%m')
+
+
+def mf_obd_to_ins_batch(sim_files, start_day, end_day):
+    """write the instruction files of the simulated daily depth to water table
+       of all wells in 'modflow.obd'.
+
+    Args:
+        - sim_files (`dict`): simulation file of each well,
+            e.g. {'wt5699': 'wt_5699.txt', 'wt5832': 'wt_5832.txt'}
+        - start_day ('str'): calibration start day, e.g. '1/1/1993'
+        - end_day ('str'): calibration end day e.g. '12/31/2000'
+
+    Example:
+        sm_pst_utils.mf_obd_to_ins_batch({'wt5699': 'wt_5699.txt'}, '1/1/1993', '12/31/2000')
+    """
+
+    return obd_to_ins_batch('modflow.obd', sim_files, start_day, end_day, '%Y%m%d')
+
+
+def _timed_step(func, args, kwargs):
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def run_extractors(steps, max_workers=None, processes=False):
+    """run independent extractors (e.g. output.rch, output.sub and MODFLOW
+       observations) concurrently and wait until all outputs are written.
+
+    Args:
+        - steps (`dict`): (function, args, kwargs) of each step by step name, e.g.
+            {'rch': (extract_month_str, ['output.rch', [9, 60], '1/1/1993', '1/1/1993', '12/31/2000'], {})}
+        - max_workers (`int`, optional): number of threads/processes.
+            If None, one for each step. Defaults to None
+        - processes (`bool`, optional): use a process pool instead of a thread pool.
+            Defaults to False
+
+    Example:
+        sm_pst_utils.run_extractors({
+            'rch': (extract_month_str, ['output.rch', [9, 60], '1/1/1993', '1/1/1993', '12/31/2000'], {}),
+            'sub': (extract_month_baseflow, ['output.sub', [9, 60], '1/1/1993', '1/1/1993', '12/31/2000'], {}),
+            })
+
+    Returns:
+        - `dict`: result of each step
+        - `dict`: wall time (seconds) of each step
+    """
+
+    if max_workers is None:
+        max_workers = max(len(steps), 1)
+    if processes:
+        from concurrent.futures import ProcessPoolExecutor as pool
+    else:
+        pool = ThreadPoolExecutor
+    with pool(max_workers=max_workers) as executor:
+        futures = {
+            name: executor.submit(_timed_step, func, args, kwargs)
+            for name, (func, args, kwargs) in steps.items()}
+        results, timings = {}, {}
+        for name, future in futures.items():
+            results[name], timings[name] = future.result()
+    for name, elapsed in timings.items():
+        print('{:<10s} {:8.2f} s'.format(name, elapsed))
+    return results, timings
+
+
+def write_sim_obs(sims, obs_file='sim_obs.out', missing=-999):
+    """write all simulated observations to one fixed-width file.
+
+    Args:
+        - sims (`list`): `pandas.Series` of simulated values by observation name, e.g.
+            returned by `extract_month_str`, `extract_month_baseflow` and
+            `extract_watertable_sim` with `write_files=False`
+        - obs_file (`str`, optional): the file to write. Defaults to 'sim_obs.out'
+        - missing (`float`, optional): value written for NaN (no simulated value),
+            so every run writes the same lines. Defaults to -999
+    Note:
+        Each line holds an observation name (columns 1-20) and its value
+        (columns 21-36), in the order of `sims`. Use `sim_obs_to_ins` to
+        write the matching instruction file.
+
+    Raises:
+        Exception: an observation name is longer than 20 characters
+
+    Example:
+        sm_pst_utils.write_sim_obs([
+            extract_month_str('output.rch', [9, 60], '1/1/1993', '1/1/1993', '12/31/2000', write_files=False),
+            extract_watertable_sim([5699], '1/1/1993', '12/31/2000', write_files=False)])
+    """
+
+    sims = pd.concat(sims)
+    long_names = [x for x in sims.index if len(x) > 20]
+    if long_names:
+        raise Exception("observation names longer than 20 characters: {}".format(long_names[:5]))
+    sims = sims.fillna(missing)
+    with open(obs_file, 'w') as f:
+        f.write(''.join(map('{:<20s}{:16.7e}\n'.format, sims.index, sims.values)))
+    print('{} file has been created...'.format(obs_file))
+
+
+# *.obd file and observation name date format of the simulated value names of
+# `write_sim_obs` ('cha009_199301', 'wt5699_19930115')
+SIM_OBS_OBD = {
+    'cha': ('streamflow.obd', '%Y%m'),
+    'wt': ('modflow.obd', '%Y%m%d'),
+    }
+_SIM_OBS_NAME = re.compile(r'^([a-z]+)(\d+)_(\d+)$')
+
+
+def sim_obs_to_ins(
+                obs_file='sim_obs.out', ins_file=None, obs_names=None, missing=-999,
+                start_day=None, end_day=None, obd_files=None):
+    """write an instruction file for the file written by `write_sim_obs`.
+
+    Args:
+        - obs_file (`str`, optional): the simulated observation file. Defaults to 'sim_obs.out'
+        - ins_file (`str`, optional): instruction file to write. If None, use
+            `obs_file` +".ins". Defaults to None
+        - obs_names (`list`, optional): observations to read, other lines are
+            skipped (e.g. no measured data). If None, read all lines. Defaults to None
+        - missing (`float`, optional): lines with this value (NaN in `write_sim_obs`)
+            are skipped too. Defaults to -999
+        - start_day ('str', optional): calibration start day, e.g. '1/1/1993'.
+            If given with `end_day`, the observations are named and masked after
+            the *.obd files. Defaults to None
+        - end_day ('str', optional): calibration end day e.g. '12/31/2000'. Defaults to None
+        - obd_files (`dict`, optional): *.obd file and date format of each name
+            prefix. Defaults to `SIM_OBS_OBD`
+    Note:
+        Write the instruction file from the outputs of a complete model run.
+        With `start_day` and `end_day`, a 'cha009_199301' line is read as the
+        observation 'sub009_199301' of the 'streamflow.obd' column ending in the
+        same number, as `obd_to_ins_batch` names it, and skipped (as there)
+        where the column has no measured value in the calibration period. Lines
+        of other prefixes (e.g. 'bfr_009') keep their names.
+
+    Example:
+        sm_pst_utils.sim_obs_to_ins('sim_obs.out', start_day='1/1/1993', end_day='12/31/2000')
+
+    Raises:
+        Exception: a line does not have the layout of `write_sim_obs`, or no *.obd
+            column matches its number
+
+    Returns:
+        `list`: instructions
+    """
+
+    if ins_file is None:
+        ins_file = obs_file + ".ins"
+    names = []
+    with open(obs_file) as f:
+        for line in f:
+            items = line.split()
+            if len(items) != 2 or len(items[0]) > 20 or line[:20].strip() != items[0]:
+                raise Exception("'{}' is not a line of write_sim_obs: {}".format(obs_file, line.strip()))
+            try:
+                val = float(items[1])
+            except ValueError:
+                raise Exception("'{}' is not a line of write_sim_obs: {}".format(obs_file, line.strip()))
+            names.append(None if val == missing or np.isnan(val) else items[0])
+    if start_day is not None and end_day is not None:
+        names = _obd_names(names, start_day, end_day, obd_files or SIM_OBS_OBD)
+    if obs_names is not None:
+        obs_names = set(obs_names)
+    ins = [
+        'l1 [{}]21:36'.format(x) if x is not None and (obs_names is None or x in obs_names) else 'l1'
+        for x in names]
+    with open(ins_file, 'w') as f:
+        f.write("pif ~\n" + "\n".join(ins) + "\n")
+    print('{} file has been created...'.format(ins_file))
+    return ins
+
+
+def _obd_names(names, start_day, end_day, obd_files):
+    # observation names of the *.obd columns; None where there is no measured value
+    found = {}
+    for name in names:
+        match = _SIM_OBS_NAME.match(name or '')
+        if match and match.group(1) in obd_files:
+            found.setdefault(match.group(1), set()).add(int(match.group(2)))
+    renames = {}
+    for prefix, ids in found.items():
+        obd_file, date_fmt = obd_files[prefix]
+        obd = _read_obd(obd_file, start_day, end_day)
+        cols = {}
+        for col in obd.columns:
+            match = re.search(r'(\d+)$', col)
+            if match:
+                cols[int(match.group(1))] = col
+        for i in ids:
+            if i not in cols:
+                raise Exception("'{}' has no column for {}{}".format(obd_file, prefix, i))
+            measured = obd[cols[i]].dropna()
+            renames[prefix, i] = (cols[i], set(pd.DatetimeIndex(measured.index).strftime(date_fmt)))
+    results = []
+    for name in names:
+        match = _SIM_OBS_NAME.match(name or '')
+        if match and match.group(1) in obd_files:
+            col, dates = renames[match.group(1), int(match.group(2))]
+            name = '{}_{}'.format(col, match.group(3)) if match.group(3) in dates else None
+        results.append(name)
+    return results
+
+
 def extract_month_avg(cha_file, channels, start_day, cal_day=None, end_day=None):
     """extract a simulated streamflow from the channel_day.txt file,
         store it in each channel file.
 
     Args:
-        - cha_file (`str`): the path and name of the existing output file
+        - cha_file (`str`): the path of the folder with the channel_day.txt file
         - channels (`list`): channel number in a list, e.g. [9, 60]
         - start_day ('str'): simulation start day after warm period, e.g. '1/1/1993'
         - end_day ('str'): simulation end day e.g. '12/31/2000'
 
+    Note:
+        channel_day.txt is read once; all channels are converted to monthly
+        averages together and written to `cha_file`.
+
     Example:
-        pest_utils.extract_month_str('path', [9, 60], '1/1/1993', '12/31/2000')
+        pest_utils.extract_month_avg('path', [9, 60], '1/1/1993', '12/31/2000')
+
+    Returns:
+        `pandas.DataFrame`: monthly average streamflow of each channel
     """
 
-    for i in channels:
-        # Get only necessary simulated streamflow and convert monthly average streamflow
-        os.chdir(cha_file)
-        print(os.getcwd())
-        df_str = pd.read_csv(
-                            "channel_day.txt",
-                            delim_whitespace=True,
-                            skiprows=3,
-                            usecols=[6, 8],
-                            names=['name', 'flo_out'],
-                            header=None
-                            )
-        df_str = df_str.loc[df_str['name'] == 'cha{:02d}'.format(i)]
-        df_str.index = pd.date_range(start_day, periods=len(df_str.flo_out))
-        mdf = df_str.resample('M').mean()
-        mdf.index.name = 'date'
-        if cal_day is None:
-            cal_day = start_day
-        else:
-            cal_day = cal_day
-        if end_day is None:
-            mdf = mdf[cal_day:]
-        else:
-            mdf = mdf[cal_day:end_day]
-        mdf.to_csv('cha_mon_avg_{:03d}.txt'.format(i), sep='\t', float_format='%.7e')
-        print('cha_{:03d}.txt file has been created...'.format(i))
-        return mdf
+    # Get only necessary simulated streamflow and convert monthly average streamflow
+    df_str = pd.read_csv(
+                        os.path.join(cha_file, "channel_day.txt"),
+                        delim_whitespace=True,
+                        skiprows=3,
+                        usecols=[6, 8],
+                        names=['name', 'flo_out'],
+                        header=None
+                        )
+    cha_names = ['cha{:02d}'.format(i) for i in channels]
+    df_str = df_str.loc[df_str['name'].isin(cha_names)]
+    df_str = df_str.assign(day=df_str.groupby('name').cumcount())
+    df_str = df_str.pivot(index='day', columns='name', values='flo_out')
+    df_str.index = _date_index(start_day, periods=len(df_str))
+    mdf = df_str.resample('M').mean()
+    mdf.index.name = 'date'
+    if cal_day is None:
+        cal_day = start_day
+    if end_day is None:
+        mdf = mdf[cal_day:]
+    else:
+        mdf = mdf[cal_day:end_day]
+    for i, cha_name in zip(channels, cha_names):
+        mdf.loc[:, [cha_name]].rename(columns={cha_name: 'flo_out'}).to_csv(
+                        os.path.join(cha_file, 'cha_mon_avg_{:03d}.txt'.format(i)),
+                        sep='\t', float_format='%.7e')
+        print('cha_mon_avg_{:03d}.txt file has been created...'.format(i))
+    return mdf
 
 
 def model_in_to_template_file(model_in_file, tpl_file=None):
@@ -299,6 +691,8 @@ def model_in_to_template_file(model_in_file, tpl_file=None):
         **pandas.DataFrame**: a dataFrame with template file information
     """
 
+    from pyemu.pst.pst_utils import SFMT
+
     if tpl_file is None:
         tpl_file = model_in_file + ".tpl"
     mod_df = pd.read_csv(
@@ -339,6 +733,8 @@ def riv_par_to_template_file(riv_par_file, tpl_file=None):
         **pandas.DataFrame**: a dataFrame with template file information
     """
 
+    from pyemu.pst.pst_utils import SFMT
+
     if tpl_file is None:
         tpl_file = riv_par_file + ".tpl"
     mf_par_df = pd.read_csv(
@@ -367,10 +763,27 @@ def _remove_readonly(func, path, excinfo):
     func(path)
 
 
+def _copy_master(master_dir, worker_dir, provision='copy', manifest=None):
+    """copy the master dir to a new worker dir, see `sm_pst_workers.provision_worker`"""
+    if provision == 'copy':
+        shutil.copytree(master_dir, worker_dir)
+    else:
+        from sm_pst_workers import provision_worker
+        provision_worker(master_dir, worker_dir, mode=provision, manifest=manifest)
+
+
+def _load_scaler(scale):
+    if not scale:
+        return None
+    from sm_pst_workers import LoadScaler
+    return LoadScaler(**(scale if isinstance(scale, dict) else {}))
+
+
 # NOTE: Update description
 def execute_beopest(
                 master_dir, pst, num_workers=None, worker_root='..', port=4005, local=True,
-                reuse_workers=None, restart=None):
+                reuse_workers=None, restart=None, provision='copy', manifest=None,
+                exe='beopest64', run_manager=None, scale=None, pin=False, tmpfs=None, daemon=None):
     """Execute BeoPEST and workers on the local machine
 
     Args:
@@ -381,6 +794,36 @@ def execute_beopest(
         port (int, optional): [description]. Defaults to 4005.
         local (bool, optional): [description]. Defaults to True.
         reuse_workers ([type], optional): [description]. Defaults to None.
+            If 'sync', existing worker dirs are updated with the files that changed in
+            the master dir (in parallel, see `sm_pst_workers.sync_workers`).
+        provision (str, optional): how new worker dirs are created from the master dir,
+            'copy', 'hardlink' or 'reflink', see `sm_pst_workers.provision_worker`.
+            Defaults to 'copy'.
+        manifest (str or list, optional): files that are always copied when
+            `provision` is not 'copy'. Defaults to None ('worker_copy.txt' or
+            `sm_pst_workers.COPY_PATTERNS`).
+        exe (str or list, optional): BeoPEST program. Defaults to 'beopest64'.
+        run_manager (bool, optional): run the master and workers as child processes
+            with `sm_pst_workers.RunManager` and wait until the master finishes,
+            instead of 'start cmd /k'. Defaults to None (True if not on Windows).
+        scale (bool or dict, optional): adjust the number of active workers to the
+            measured load with `sm_pst_workers.LoadScaler` (run manager on Linux only);
+            a dict is passed to LoadScaler, e.g. {'window': 300}. Defaults to None.
+        pin (bool, optional): pin each worker to its own cores and NUMA node (run
+            manager on Linux only); the placement is written to 'worker_layout.json'.
+            Defaults to False.
+        tmpfs (str or bool, optional): RAM-backed folder (True for '/dev/shm') to
+            stage the worker dirs in, see `sm_pst_workers.stage_workers_tmpfs`.
+            The worker dirs become links to it; the result files are copied back
+            and the stage is removed when the run ends (run manager only).
+            Defaults to None.
+        daemon (str, optional): forward run config file; the run manager starts a
+            `sm_pst_daemon` with it in each worker dir, in the process group and
+            placement of the worker (the *.pst model command line must be
+            'python forward_run_client.py'). Defaults to None.
+
+    Returns:
+        int: exit code of the master with the run manager, otherwise None.
 
     Raises:
         Exception: [description]
@@ -391,6 +834,9 @@ def execute_beopest(
         Exception: [description]
     """
 
+    import multiprocessing as mp
+    import socket
+
     if not os.path.isdir(master_dir):
         raise Exception("master dir '{0}' not found".format(master_dir))
     if not os.path.isdir(worker_root):
@@ -405,24 +851,44 @@ def execute_beopest(
     else:
         hostname = socket.gethostname()
 
+    if run_manager is None:
+        run_manager = os.name != 'nt'
+    if tmpfs and not run_manager:
+        raise Exception("tmpfs staging needs the run manager")
+    if daemon and not run_manager:
+        raise Exception("forward run daemons need the run manager")
+
     base_dir = os.getcwd()
     port = int(port)
     cwd = os.chdir(master_dir)
-    os.system("start cmd /k beopest64 {0} /h :{1}".format(pst, port))
-    time.sleep(1.5) # a few cycles to let the master get ready
+    master_dir = os.getcwd()
+    if not run_manager:
+        os.system("start cmd /k {0} {1} /h :{2}".format(exe, pst, port))
+        time.sleep(1.5) # a few cycles to let the master get ready
     
     tcp_arg = "{0}:{1}".format(hostname,port)
-    worker_dirs = []
+    worker_dirs = [os.path.abspath(os.path.join(worker_root, "worker_{0}".format(i))) for i in range(num_workers)]
+    stage = None
+    if tmpfs:
+        from sm_pst_workers import stage_workers_tmpfs
+        stage = stage_workers_tmpfs(
+                    master_dir, worker_dirs, stage_root='/dev/shm' if tmpfs is True else tmpfs,
+                    manifest=manifest)
+    elif reuse_workers == 'sync':
+        from sm_pst_workers import sync_workers
+        sync_workers(master_dir, worker_dirs, mode=provision, manifest=manifest)
     for i in range(num_workers):
-        new_worker_dir = os.path.join(worker_root,"worker_{0}".format(i))
-        if os.path.exists(new_worker_dir) and reuse_workers is None:
+        new_worker_dir = worker_dirs[i] if run_manager else os.path.join(worker_root,"worker_{0}".format(i))
+        if stage is not None or reuse_workers == 'sync':
+            pass
+        elif os.path.exists(new_worker_dir) and reuse_workers is None:
             try:
                 shutil.rmtree(new_worker_dir, onerror=_remove_readonly)#, onerror=del_rw)
             except Exception as e:
                 raise Exception("unable to remove existing worker dir:" + \
                                 "{0}\n{1}".format(new_worker_dir,str(e)))
             try:
-                shutil.copytree(master_dir,new_worker_dir)
+                _copy_master(master_dir, new_worker_dir, provision, manifest)
             except Exception as e:
                 raise Exception("unable to copy files from worker dir: " + \
                                 "{0} to new worker dir: {1}\n{2}".format(master_dir,new_worker_dir,str(e)))
@@ -434,17 +900,33 @@ def execute_beopest(
                                 "{0} to new worker dir: {1}\n{2}".format(master_dir,new_worker_dir,str(e)))
         else:
             try:
-                shutil.copytree(master_dir,new_worker_dir)
+                _copy_master(master_dir, new_worker_dir, provision, manifest)
             except Exception as e:
                 raise Exception("unable to copy files from worker dir: " + \
                                 "{0} to new worker dir: {1}\n{2}".format(master_dir,new_worker_dir,str(e)))
-        cwd = new_worker_dir
-        os.chdir(cwd)
-        os.system("start cmd /k beopest64 {0} /h {1}".format(pst, tcp_arg))
+        if not run_manager:
+            cwd = new_worker_dir
+            os.chdir(cwd)
+            os.system("start cmd /k {0} {1} /h {2}".format(exe, pst, tcp_arg))
+    if run_manager:
+        from sm_pst_workers import RunManager, remove_tmpfs_stage
+        try:
+            ret = RunManager(
+                    master_dir, pst, worker_dirs, exe=exe, port=port, host=hostname, pin=pin,
+                    daemon=daemon).run(
+                callback=_load_scaler(scale))
+        finally:
+            if stage is not None:
+                remove_tmpfs_stage(stage, worker_dirs)
+        os.chdir(base_dir)
+        return ret
 
 
 # TODO: copy pst / option to use an existing worker
-def execute_workers(worker_rep, pst, host, num_workers=None, start_id=None, worker_root='..', port=4005, reuse_workers=None):
+def execute_workers(
+                worker_rep, pst, host, num_workers=None, start_id=None, worker_root='..', port=4005,
+                reuse_workers=None, provision='copy', manifest=None, exe='beopest64', run_manager=None,
+                scale=None, pin=False, tmpfs=None, daemon=None):
     """[summary]
 
     Args:
@@ -455,6 +937,20 @@ def execute_workers(worker_rep, pst, host, num_workers=None, start_id=None, work
         start_id ([type], optional): [description]. Defaults to None.
         worker_root (str, optional): [description]. Defaults to '..'.
         port (int, optional): [description]. Defaults to 4005.
+        reuse_workers ([type], optional): None, True or 'sync', see `execute_beopest`.
+            Defaults to None.
+        provision (str, optional): 'copy', 'hardlink' or 'reflink', see `execute_beopest`.
+            Defaults to 'copy'.
+        manifest (str or list, optional): files that are always copied, see
+            `execute_beopest`. Defaults to None.
+        exe (str or list, optional): BeoPEST program. Defaults to 'beopest64'.
+        run_manager (bool, optional): run the workers as child processes with
+            `sm_pst_workers.RunManager` and wait until they finish. Defaults to None
+            (True if not on Windows).
+        scale (bool or dict, optional): see `execute_beopest`. Defaults to None.
+        pin (bool, optional): see `execute_beopest`. Defaults to False.
+        tmpfs (str or bool, optional): see `execute_beopest`. Defaults to None.
+        daemon (str, optional): see `execute_beopest`. Defaults to None.
 
     Raises:
         Exception: [description]
@@ -463,6 +959,9 @@ def execute_workers(worker_rep, pst, host, num_workers=None, start_id=None, work
         Exception: [description]
     """
 
+    import multiprocessing as mp
+    import socket
+
     if not os.path.isdir(worker_rep):
         raise Exception("master dir '{0}' not found".format(worker_rep))
     if not os.path.isdir(worker_root):
@@ -476,22 +975,44 @@ def execute_workers(worker_rep, pst, host, num_workers=None, start_id=None, work
     else:
         start_id = start_id
 
+    if run_manager is None:
+        run_manager = os.name != 'nt'
+    if tmpfs and not run_manager:
+        raise Exception("tmpfs staging needs the run manager")
+    if daemon and not run_manager:
+        raise Exception("forward run daemons need the run manager")
+
     hostname = host
     base_dir = os.getcwd()
     port = int(port)
     cwd = os.chdir(worker_rep)
+    worker_rep = os.getcwd()
     tcp_arg = "{0}:{1}".format(hostname,port)
+    worker_dirs = [
+        os.path.abspath(os.path.join(worker_root, "worker_{0}".format(i)))
+        for i in range(start_id, num_workers + start_id)]
+    stage = None
+    if tmpfs:
+        from sm_pst_workers import stage_workers_tmpfs
+        stage = stage_workers_tmpfs(
+                    worker_rep, worker_dirs, stage_root='/dev/shm' if tmpfs is True else tmpfs,
+                    manifest=manifest)
+    elif reuse_workers == 'sync':
+        from sm_pst_workers import sync_workers
+        sync_workers(worker_rep, worker_dirs, mode=provision, manifest=manifest)
 
     for i in range(start_id, num_workers + start_id):
-        new_worker_dir = os.path.join(worker_root,"worker_{0}".format(i))
-        if os.path.exists(new_worker_dir) and reuse_workers is None:
+        new_worker_dir = worker_dirs[i - start_id] if run_manager else os.path.join(worker_root,"worker_{0}".format(i))
+        if stage is not None or reuse_workers == 'sync':
+            pass
+        elif os.path.exists(new_worker_dir) and reuse_workers is None:
             try:
                 shutil.rmtree(new_worker_dir, onerror=_remove_readonly)#, onerror=del_rw)
             except Exception as e:
                 raise Exception("unable to remove existing worker dir:" + \
                                 "{0}\n{1}".format(new_worker_dir,str(e)))
             try:
-                shutil.copytree(worker_rep,new_worker_dir)
+                _copy_master(worker_rep, new_worker_dir, provision, manifest)
             except Exception as e:
                 raise Exception("unable to copy files from worker dir: " + \
                                 "{0} to new worker dir: {1}\n{2}".format(worker_rep,new_worker_dir,str(e)))
@@ -503,13 +1024,25 @@ def execute_workers(worker_rep, pst, host, num_workers=None, start_id=None, work
                                 "{0} to new worker dir: {1}\n{2}".format(worker_rep,new_worker_dir,str(e)))
         else:
             try:
-                shutil.copytree(worker_rep,new_worker_dir)
+                _copy_master(worker_rep, new_worker_dir, provision, manifest)
             except Exception as e:
                 raise Exception("unable to copy files from worker dir: " + \
                                 "{0} to new worker dir: {1}\n{2}".format(worker_rep,new_worker_dir,str(e)))
                             
-        cwd = new_worker_dir
-        os.chdir(cwd)
-        os.system("start cmd /k beopest64 {0} /h {1}".format(pst, tcp_arg))
+        if not run_manager:
+            cwd = new_worker_dir
+            os.chdir(cwd)
+            os.system("start cmd /k {0} {1} /h {2}".format(exe, pst, tcp_arg))
+    if run_manager:
+        from sm_pst_workers import RunManager, remove_tmpfs_stage
+        try:
+            RunManager(
+                None, pst, worker_dirs, exe=exe, port=port, host=hostname, pin=pin,
+                daemon=daemon).run(
+                callback=_load_scaler(scale))
+        finally:
+            if stage is not None:
+                remove_tmpfs_stage(stage, worker_dirs)
+        os.chdir(base_dir)
 
 
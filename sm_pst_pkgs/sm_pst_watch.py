@@ -0,0 +1,260 @@
+""" Early-abort watchdog of a model run: tails the model outputs while the model
+    runs and stops it when they show NaN or overflow ('*****') values, when they
+    stop growing, or when the run takes too long. The simulated value files are
+    then written with a penalty value, so PEST gets a (bad) result and moves on.
+
+    Example:
+        reason = sm_pst_watch.run_watched('SWAT-MODFLOW3_fp_091120', max_wall=7200, stall=600)
+        if reason is not None:
+            sm_pst_watch.write_penalty(['cha_225.txt', 'wt_5699.txt'])
+"""
+
+import os
+import re
+import time
+import shlex
+import signal
+import threading
+import subprocess
+
+
+WATCH_FILES = ['output.rch', 'swatmf_out_MF_obs']
+# NaN/Infinity of gfortran and ifort, and the asterisks of an overflowed format
+BAD_VALUE = re.compile(rb'\*{4,}|(?<![\w.])[-+]?(nan|inf|infinity)(?![\w.])', re.IGNORECASE)
+PENALTY = 1e10
+
+
+class OutputTail(object):
+    """read the lines appended to a file since the last call.
+
+    Args:
+        - path (`str`): the file; it does not need to exist yet
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pos = 0
+        self.rest = b''
+
+    def read(self):
+        """
+        Returns:
+            `list`: new complete lines (bytes); a partly written last line is kept
+            for the next call
+        """
+
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.pos:
+            # rewritten by the model
+            self.pos, self.rest = 0, b''
+        if size == self.pos:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.pos)
+            data = f.read(size - self.pos)
+        self.pos += len(data)
+        lines = (self.rest + data).split(b'\n')
+        self.rest = lines.pop()
+        return lines
+
+
+def _descendants(pid):
+    # child processes of `pid`, recursively (Linux /proc)
+    children = {}
+    try:
+        pids = [x for x in os.listdir('/proc') if x.isdigit()]
+    except OSError:
+        return []
+    for x in pids:
+        try:
+            with open('/proc/{}/stat'.format(x)) as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(x))
+    found, todo = [], [pid]
+    while todo:
+        for child in children.get(todo.pop(), []):
+            found.append(child)
+            todo.append(child)
+    return found
+
+
+def _kill(proc, timeout=5):
+    # the model and the processes it started; not the process group, which
+    # is the one of the PEST worker (so it can pause and stop its model runs)
+    if proc.poll() is not None:
+        return
+    if os.name == 'nt':
+        subprocess.call(
+            'taskkill /F /T /PID {}'.format(proc.pid), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc.wait()
+        return
+    pids = [proc.pid] + _descendants(proc.pid)
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except OSError:
+                pass
+        try:
+            proc.wait(timeout)
+            break
+        except subprocess.TimeoutExpired:
+            continue
+    proc.wait()
+
+
+def _terminated(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def run_watched(cmd, wd='.', files=None, max_wall=None, stall=None, interval=1.0, check_values=True):
+    """run the model and stop it early when its outputs go bad.
+
+    Args:
+        - cmd (`str`): model executable (and arguments)
+        - wd (`str`, optional): working directory. Defaults to '.'
+        - files (`list`, optional): model output files to tail, relative to `wd`.
+            Defaults to ['output.rch', 'swatmf_out_MF_obs']
+        - max_wall (`float`, optional): wall time budget of the run (s). If None,
+            no limit. Defaults to None
+        - stall (`float`, optional): stop the run if none of the files grows for
+            this long (s), counted from the start of the run. If None, no limit.
+            Defaults to None
+        - interval (`float`, optional): seconds between checks. Defaults to 1.0
+        - check_values (`bool`, optional): stop on NaN, Infinity or '*****' in the
+            new lines of the files. Defaults to True
+    Note:
+        Only the lines written since the last check are read, so a check costs
+        little however big the outputs grow. The files left by the previous run
+        are removed first, as the model writes them again.
+        The model stays in the process group of the caller (e.g. a BeoPEST worker
+        started by `sm_pst_workers.RunManager`), so pausing, stopping and measuring
+        the worker include its model run. A command without shell syntax
+        (redirections, pipes) is started without a shell. On SIGTERM the model is
+        killed before this process exits.
+
+    Returns:
+        `str`: why the run was stopped, or None if the model finished
+
+    Raises:
+        Exception: the model returned a non-zero exit code by itself
+    """
+
+    exe = cmd.split()[0]
+    if os.name != 'nt' and os.path.exists(os.path.join(wd, exe)):
+        cmd = './' + cmd
+    shell = os.name == 'nt' or any(c in cmd for c in '<>|&;$`')
+    if shell and os.name != 'nt':
+        # the shell becomes the model, so it gets the signals
+        cmd = 'exec ' + cmd
+    elif not shell:
+        cmd = shlex.split(cmd)
+    tails = [OutputTail(os.path.join(wd, f)) for f in (files or WATCH_FILES)]
+    for tail in tails:
+        if os.path.exists(tail.path):
+            os.remove(tail.path)
+    prev_handler = None
+    if os.name != 'nt' and threading.current_thread() is threading.main_thread():
+        prev_handler = signal.signal(signal.SIGTERM, _terminated)
+    start = last_growth = time.perf_counter()
+    sizes = [None] * len(tails)
+    proc = subprocess.Popen(cmd, shell=shell, cwd=wd)
+    reason = None
+    try:
+        while True:
+            try:
+                ret = proc.wait(interval)
+            except subprocess.TimeoutExpired:
+                ret = None
+            now = time.perf_counter()
+            for i, tail in enumerate(tails):
+                lines = tail.read() if check_values else []
+                for line in lines:
+                    if BAD_VALUE.search(line):
+                        reason = 'bad value in {}: {}'.format(
+                            os.path.basename(tail.path), line.decode(errors='replace').strip()[:80])
+                        break
+                if reason is not None:
+                    break
+                try:
+                    size = os.path.getsize(tail.path)
+                except OSError:
+                    size = None
+                if size != sizes[i]:
+                    sizes[i] = size
+                    last_growth = now
+            if ret is not None or reason is not None:
+                break
+            if max_wall is not None and now - start > max_wall:
+                reason = 'wall time budget of {} s exceeded'.format(max_wall)
+                break
+            if stall is not None and now - last_growth > stall:
+                reason = 'no output for {} s'.format(stall)
+                break
+    except BaseException:
+        _kill(proc)
+        raise
+    finally:
+        if prev_handler is not None:
+            signal.signal(signal.SIGTERM, prev_handler)
+    if reason is not None:
+        _kill(proc)
+        print('Model run has been stopped: {}...'.format(reason))
+        return reason
+    if ret != 0:
+        raise Exception("run() returned non-zero: {}".format(ret))
+    return None
+
+
+def _is_number(s):
+    try:
+        float(s)
+    except ValueError:
+        return False
+    return True
+
+
+def write_penalty(out_files, wd='.', value=PENALTY):
+    """write the penalty value into the simulated value files of a stopped run.
+
+    Args:
+        - out_files (`list`): simulated value files read by PEST, relative to `wd`
+            (see `sm_pst_run.output_files`)
+        - wd (`str`, optional): working directory. Defaults to '.'
+        - value (`float`, optional): the penalty value. Defaults to 1e10
+    Note:
+        The last value of each line of the files of the previous run is replaced,
+        so the instruction files still match. A missing file cannot be rebuilt
+        and is left missing (PEST then counts the run as failed).
+
+    Returns:
+        `list`: files written
+    """
+
+    pen = '{:.7e}'.format(value)
+    written = []
+    for out_file in out_files:
+        path = os.path.join(wd, out_file)
+        if not os.path.exists(path):
+            print("WARNING: '{}' not found, no penalty written".format(out_file))
+            continue
+        with open(path) as f:
+            lines = f.read().splitlines()
+        new = []
+        for line in lines:
+            parts = re.split(r'(\s+)', line)
+            for j in range(len(parts) - 1, -1, -1):
+                if parts[j].strip() and _is_number(parts[j]):
+                    parts[j] = pen
+                    break
+            new.append(''.join(parts))
+        with open(path, 'w', newline='') as f:
+            f.write('\n'.join(new) + '\n')
+        written.append(out_file)
+    print('Penalty values have been written to {} files...'.format(len(written)))
+    return written
@@ -0,0 +1,1122 @@
+""" Worker management for BeoPEST runs: builds worker_N folders from the master
+    folder with reflinks or hardlinks instead of full copies, brings existing
+    worker folders up to date with the master incrementally, and runs the
+    master and workers as child processes (RunManager).
+
+    Only known read-only model inputs (LINK_PATTERNS) are ever hardlinked or
+    symlinked; all other files are real copies (or reflinks). Files that a run
+    rewrites in place (parameter files, edited SWAT inputs, model outputs, ...)
+    are always copied even if they match LINK_PATTERNS; they are listed in a
+    manifest of glob patterns, 'worker_copy.txt' in the master folder or
+    COPY_PATTERNS.
+"""
+
+import os
+import sys
+import json
+import atexit
+import time
+import errno
+import signal
+import shutil
+import socket
+import fnmatch
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+COPY_MANIFEST = 'worker_copy.txt'
+
+# state of the master files at the last sync, in the master and each worker folder
+SYNC_FILE = 'worker_sync.json'
+
+# files rewritten by a forward run, relative to the master folder
+COPY_PATTERNS = [
+    # PEST
+    '*.pst', '*.rmf', '*.rmr', '*.rec', '*.rst', 'model.in', 'mf_riv.par',
+    # river package (riv_par)
+    '*.riv', 'riv_package.org', 'riv_package.org.idx',
+    # SWAT inputs edited by swat_edit/Swat_Edit.exe
+    '?????????.gw', '?????????.hru', '?????????.sub', '?????????.rte', '?????????.mgt',
+    'swat_edit.idx', 'swat_edit.state',
+    # model outputs
+    'output.*', '*.out', '*.std', 'watout.dat', 'fin.fin', 'channel_*.txt', 'swatmf_out_*',
+    '*.hds', '*.cbb', '*.cbc', '*.lst', '*.list', '*.stdout',
+    # extracted simulated values and sm_pst_* files
+    'cha_*.txt', 'wt_*.txt', 'sim_obs.out', 'sm_pst_timing.log', 'sm_pst_daemon.port',
+    ]
+
+# read-only model inputs that may be shared by hardlinks/symlinks, relative to
+# the master folder; the COPY_PATTERNS (or manifest) still take precedence.
+# SWAT inputs that Swat_Edit.exe or sm_pst_swat.swat_edit can rewrite in place
+# (.gw, .hru, .sub, .rte, .mgt, .sol, .bsn, .chm, .pnd, .res, .swq, .wwq, .sep,
+# .ops, *.dat databases, ...) are never linked, whatever the manifest says.
+LINK_PATTERNS = [
+    # SWAT: weather, generator and model structure files
+    'file.cio', 'fig.fig', '*.pcp', '*.tmp', '*.slr', '*.hmd', '*.wnd', '*.pet', '*.wgn',
+    'Backup/*',
+    # MODFLOW and the SWAT-MODFLOW linkage
+    '*.nam', '*.dis', '*.bas', '*.ba6', '*.upw', '*.lpf', '*.nwt', '*.pcg', '*.oc',
+    '*.wel', '*.drn', '*.ghb', '*.chd', '*.sfr', 'swatmf_link.txt', 'swatmf_dhru2grid.txt',
+    'swatmf_grid2dhru.txt', 'swatmf_river2grid.txt', 'modflow.obs',
+    # PEST templates and instructions, executables
+    '*.tpl', '*.ins', '*.exe', '*.dll',
+    ]
+
+# ioctl request to clone a file (Linux btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+def read_copy_manifest(master_dir, manifest=None):
+    """read the glob patterns of the files that are copied into the workers.
+
+    Args:
+        - master_dir (`str`): the master folder
+        - manifest (`str` or `list`, optional): manifest file, relative to `master_dir`,
+            or a list of patterns. If None, 'worker_copy.txt' in `master_dir` if it
+            exists, otherwise COPY_PATTERNS. Defaults to None
+    Note:
+        A manifest file has one pattern per line, relative to `master_dir`
+        (e.g. '*.riv', 'Backup/*.gw'); '#' starts a comment.
+
+    Returns:
+        `list`: glob patterns
+    """
+
+    if isinstance(manifest, (list, tuple)):
+        return list(manifest)
+    if manifest is None:
+        manifest = COPY_MANIFEST
+        if not os.path.exists(os.path.join(master_dir, manifest)):
+            return list(COPY_PATTERNS)
+    patterns = []
+    with open(os.path.join(master_dir, manifest)) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                patterns.append(line)
+    return patterns
+
+
+def _match(rel_path, patterns):
+    rel_path = rel_path.replace(os.sep, '/')
+    return any(fnmatch.fnmatch(rel_path, p) for p in patterns)
+
+
+def _linkable(rel_path, copy_patterns):
+    return _match(rel_path, LINK_PATTERNS) and not _match(rel_path, copy_patterns)
+
+
+def reflink(src, dst):
+    """clone a file (copy-on-write) if the file system supports it.
+
+    Raises:
+        OSError: the file system or platform does not support reflinks
+    """
+
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported on this platform')
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+class _Placer(object):
+    # puts master files into a worker folder; stops trying what the file system
+    # does not support
+
+    def __init__(self, mode, patterns):
+        if mode not in ('reflink', 'hardlink', 'symlink', 'copy'):
+            raise Exception("unknown provisioning mode '{}'".format(mode))
+        self.patterns = patterns
+        self.can_reflink = mode == 'reflink'
+        self.can_link = mode in ('reflink', 'hardlink')
+        self.can_symlink = mode == 'symlink'
+        self.counts = {'reflink': 0, 'hardlink': 0, 'symlink': 0, 'copy': 0}
+
+    def place(self, src, dst, rel_path):
+        writable = not _linkable(rel_path, self.patterns)
+        if self.can_symlink and not writable:
+            try:
+                os.symlink(os.path.abspath(src), dst)
+                self.counts['symlink'] += 1
+                return
+            except OSError:
+                self.can_symlink = False
+        if self.can_reflink:
+            try:
+                reflink(src, dst)
+                self.counts['reflink'] += 1
+                return
+            except OSError:
+                self.can_reflink = False
+        if self.can_link and not writable:
+            try:
+                os.link(src, dst)
+                self.counts['hardlink'] += 1
+                return
+            except OSError:
+                self.can_link = False
+        shutil.copy2(src, dst)
+        self.counts['copy'] += 1
+
+
+def provision_worker(master_dir, worker_dir, mode='reflink', manifest=None):
+    """create a worker folder from the master folder.
+
+    Args:
+        - master_dir (`str`): the master folder
+        - worker_dir (`str`): the worker folder to create, must not exist
+        - mode (`str`, optional): how the read-only inputs (LINK_PATTERNS not in
+            the manifest) are provided:
+            'reflink' (copy-on-write clone, else hardlink, else copy),
+            'hardlink' (else copy), 'symlink' (to the master file, e.g. for a worker
+            on another file system, else copy) or 'copy'. Defaults to 'reflink'
+        - manifest (`str` or `list`, optional): files that are always real copies,
+            see `read_copy_manifest`. Defaults to None
+    Note:
+        Hardlinked files share their data with the master folder: a program that
+        rewrites one of them in place changes it for all workers. So only files
+        matching LINK_PATTERNS are linked, and an input in LINK_PATTERNS that a
+        run writes to must be in the manifest. All other files are copies,
+        reflinks when possible, which are independent of the master.
+
+    Example:
+        sm_pst_workers.provision_worker('main', '../worker_0', mode='hardlink')
+
+    Returns:
+        `dict`: number of files that were reflinked, hardlinked, symlinked and copied
+    """
+
+    placer = _Placer(mode, read_copy_manifest(master_dir, manifest))
+    master_dir = os.path.abspath(master_dir)
+    for root, dirs, files in os.walk(master_dir):
+        rel_root = os.path.relpath(root, master_dir)
+        os.makedirs(os.path.normpath(os.path.join(worker_dir, rel_root)), exist_ok=rel_root != '.')
+        for fnam in files:
+            rel_path = os.path.normpath(os.path.join(rel_root, fnam))
+            if rel_path == SYNC_FILE:
+                continue
+            placer.place(os.path.join(root, fnam), os.path.join(worker_dir, rel_path), rel_path)
+    return placer.counts
+
+
+def _sha1(file_path):
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_sync_file(folder):
+    try:
+        with open(os.path.join(folder, SYNC_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_sync_file(folder, state):
+    tmp = os.path.join(folder, SYNC_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, os.path.join(folder, SYNC_FILE))
+
+
+def scan_master(master_dir, check_hash=True):
+    """get the size, modification time and hash of every file in the master folder.
+
+    Args:
+        - master_dir (`str`): the master folder
+        - check_hash (`bool`, optional): hash the files. Only files whose size or
+            modification time changed since the last scan are hashed. Defaults to True
+    Note:
+        The result is kept in 'worker_sync.json' in `master_dir`.
+
+    Returns:
+        `dict`: [size, mtime_ns, sha1 or None] of each file, relative to `master_dir`
+    """
+
+    old = _read_sync_file(master_dir)
+    state = {}
+    for root, dirs, files in os.walk(master_dir):
+        rel_root = os.path.relpath(root, master_dir)
+        for fnam in files:
+            rel_path = os.path.normpath(os.path.join(rel_root, fnam))
+            if rel_path in (SYNC_FILE, SYNC_FILE + '.tmp'):
+                continue
+            st = os.stat(os.path.join(root, fnam))
+            sig = [st.st_size, st.st_mtime_ns, None]
+            prev = old.get(rel_path)
+            if prev is not None and prev[:2] == sig[:2]:
+                sig[2] = prev[2]
+            if check_hash and sig[2] is None:
+                sig[2] = _sha1(os.path.join(root, fnam))
+            state[rel_path] = sig
+    _write_sync_file(master_dir, state)
+    return state
+
+
+def sync_worker(master_dir, worker_dir, master_state, mode='copy', manifest=None, delete=True):
+    """bring a worker folder up to date with the master folder.
+
+    Args:
+        - master_dir (`str`): the master folder
+        - worker_dir (`str`): the worker folder
+        - master_state (`dict`): the master files from `scan_master`
+        - mode (`str`, optional): how changed files are provided, see
+            `provision_worker`. Defaults to 'copy'
+        - manifest (`str` or `list`, optional): files that are always real copies,
+            see `read_copy_manifest`. Defaults to None
+        - delete (`bool`, optional): remove files that were removed from the master
+            since the last sync. Defaults to True
+    Note:
+        A file is copied only if it changed in the master since the last sync of
+        this worker (size, modification time, then hash), so the files a run writes
+        to in the worker are kept as long as the master file did not change.
+        A worker without a sync record is compared to the master by size and
+        modification time.
+
+    Returns:
+        `dict`: number of files that were reflinked, hardlinked, symlinked, copied,
+        unchanged and deleted
+    """
+
+    placer = _Placer(mode, read_copy_manifest(master_dir, manifest))
+    synced = _read_sync_file(worker_dir)
+    unchanged = deleted = 0
+    for rel_path, sig in master_state.items():
+        dst = os.path.join(worker_dir, rel_path)
+        prev = synced.get(rel_path)
+        if prev is not None and os.path.exists(dst):
+            if prev[:2] == sig[:2] or (sig[2] is not None and prev[2] == sig[2]):
+                unchanged += 1
+                continue
+        elif prev is None and os.path.exists(dst):
+            st = os.stat(dst)
+            if [st.st_size, st.st_mtime_ns] == sig[:2]:
+                unchanged += 1
+                continue
+        os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        placer.place(os.path.join(master_dir, rel_path), dst, rel_path)
+    if delete:
+        for rel_path in set(synced) - set(master_state):
+            dst = os.path.join(worker_dir, rel_path)
+            if os.path.exists(dst):
+                os.remove(dst)
+                deleted += 1
+    _write_sync_file(worker_dir, master_state)
+    return dict(placer.counts, unchanged=unchanged, deleted=deleted)
+
+
+def sync_workers(
+            master_dir, worker_dirs, mode='copy', manifest=None, check_hash=True, delete=True,
+            max_workers=None):
+    """bring worker folders up to date with the master folder in parallel.
+
+    Args:
+        - master_dir (`str`): the master folder
+        - worker_dirs (`list`): worker folders; missing ones are created
+            with `provision_worker`
+        - mode (`str`, optional): 'copy', 'hardlink', 'reflink' or 'symlink', see
+            `provision_worker`. Defaults to 'copy'
+        - manifest (`str` or `list`, optional): files that are always real copies,
+            see `read_copy_manifest`. Defaults to None
+        - check_hash (`bool`, optional): do not copy files that were only touched,
+            see `scan_master`. Defaults to True
+        - delete (`bool`, optional): see `sync_worker`. Defaults to True
+        - max_workers (`int`, optional): threads. Defaults to None
+            (ThreadPoolExecutor default)
+
+    Example:
+        sm_pst_workers.sync_workers('main', ['../worker_{}'.format(i) for i in range(32)])
+
+    Returns:
+        `dict`: counts of `sync_worker` (or `provision_worker`) for each worker folder
+    """
+
+    start = time.time()
+    master_state = scan_master(master_dir, check_hash=check_hash)
+
+    def _sync(worker_dir):
+        if not os.path.isdir(worker_dir):
+            counts = provision_worker(master_dir, worker_dir, mode=mode, manifest=manifest)
+            _write_sync_file(worker_dir, master_state)
+            return counts
+        return sync_worker(master_dir, worker_dir, master_state, mode=mode, manifest=manifest, delete=delete)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(worker_dirs, executor.map(_sync, worker_dirs)))
+    changed = sum(c['reflink'] + c['hardlink'] + c['symlink'] + c['copy'] for c in results.values())
+    print('{} worker folders have been synchronized, {} files updated in {:.1f} sec...'.format(
+        len(worker_dirs), changed, time.time() - start))
+    return results
+
+
+# file in each staged worker folder with the path of its link (the worker
+# folder the other programs know), see `sm_pst_run.worker_root`
+STAGE_LINK_FILE = 'worker_link.txt'
+
+# files kept from each worker folder when a tmpfs stage is removed
+KEEP_PATTERNS = [
+    'cha_*.txt', 'cha_mon_avg_*.txt', 'wt_*.txt', 'baseflow_ratio.out', 'sim_obs.out',
+    'sm_pst_timing.log', 'beopest.stdout',
+    ]
+
+
+def _writable_size(master_dir, patterns):
+    size = 0
+    for root, dirs, files in os.walk(master_dir):
+        rel_root = os.path.relpath(root, master_dir)
+        for fnam in files:
+            if not _linkable(os.path.normpath(os.path.join(rel_root, fnam)), patterns):
+                size += os.path.getsize(os.path.join(root, fnam))
+    return size
+
+
+def stage_workers_tmpfs(
+            master_dir, worker_dirs, stage_root='/dev/shm', manifest=None, min_free_mb=None,
+            headroom=1.5):
+    """create worker folders in a RAM-backed folder, linked from `worker_dirs`.
+
+    Args:
+        - master_dir (`str`): the master folder
+        - worker_dirs (`list`): worker folders; each becomes a symbolic link to its
+            folder in the stage. Existing folders are removed
+        - stage_root (`str`, optional): RAM-backed folder. Defaults to '/dev/shm'
+        - manifest (`str` or `list`, optional): files a run writes to, see
+            `read_copy_manifest`. Defaults to None
+        - min_free_mb (`float`, optional): memory (MemAvailable) that must remain free
+            after staging. Defaults to None (512 MB)
+        - headroom (`float`, optional): factor on the size of the writable files of
+            the master for the outputs of a run. Defaults to 1.5
+    Note:
+        The read-only inputs (LINK_PATTERNS not in the manifest) are symbolic
+        links to the master folder; all other files are copied into the stage. The writable files of the master must include the model
+        outputs (e.g. after a run in the master folder) for the size check to work.
+        The stage is removed by `remove_tmpfs_stage` or when this process exits.
+        The current directory of a run in a staged folder is the stage, so each
+        staged folder has a 'worker_link.txt' with the path of its link; the forward
+        run (`sm_pst_run.worker_root`) resolves paths outside the worker folder
+        (e.g. "../run_cache") from there, so they stay on disk and are kept.
+
+    Example:
+        stage = sm_pst_workers.stage_workers_tmpfs('main', ['../worker_0', '../worker_1'])
+        ...
+        sm_pst_workers.remove_tmpfs_stage(stage, ['../worker_0', '../worker_1'])
+
+    Raises:
+        Exception: not enough space in `stage_root` or memory
+
+    Returns:
+        `str`: the stage folder
+    """
+
+    patterns = read_copy_manifest(master_dir, manifest)
+    need = _writable_size(master_dir, patterns) * headroom * len(worker_dirs)
+    free = shutil.disk_usage(stage_root).free
+    reserve = (512 if min_free_mb is None else min_free_mb) * 2**20
+    if need > free:
+        raise Exception("'{}' has {:.0f} MB free, {} workers need about {:.0f} MB".format(
+            stage_root, free / 2**20, len(worker_dirs), need / 2**20))
+    if os.path.exists('/proc/meminfo'):
+        avail = _read_meminfo().get('MemAvailable', 0)
+        if need + reserve > avail:
+            raise Exception("{:.0f} MB of memory available, {} workers need about {:.0f} MB".format(
+                avail / 2**20, len(worker_dirs), (need + reserve) / 2**20))
+
+    import tempfile
+    stage = tempfile.mkdtemp(prefix='sm_pst_', dir=stage_root)
+    try:
+        for i, worker_dir in enumerate(worker_dirs):
+            if os.path.islink(worker_dir):
+                os.remove(worker_dir)
+            elif os.path.exists(worker_dir):
+                shutil.rmtree(worker_dir)
+            staged = os.path.join(stage, os.path.basename(os.path.normpath(worker_dir)))
+            provision_worker(master_dir, staged, mode='symlink', manifest=patterns)
+            with open(os.path.join(staged, STAGE_LINK_FILE), 'w') as f:
+                f.write(os.path.abspath(worker_dir))
+            os.symlink(staged, worker_dir)
+    except Exception:
+        remove_tmpfs_stage(stage, worker_dirs, keep=None)
+        raise
+    # also on an unexpected exit of this process
+    atexit.register(remove_tmpfs_stage, stage, list(worker_dirs))
+    print('{} worker folders have been staged in "{}" ({:.0f} MB estimated)...'.format(
+        len(worker_dirs), stage, need / 2**20))
+    return stage
+
+
+def remove_tmpfs_stage(stage, worker_dirs, keep=KEEP_PATTERNS):
+    """remove a stage of `stage_workers_tmpfs`, keeping the result files.
+
+    Args:
+        - stage (`str`): the stage folder
+        - worker_dirs (`list`): the worker folders (links into the stage)
+        - keep (`list`, optional): files copied back into a real worker folder
+            before the stage is removed. If None, nothing is kept. Defaults to KEEP_PATTERNS
+    """
+
+    for worker_dir in worker_dirs:
+        if not os.path.islink(worker_dir):
+            continue
+        staged = os.path.realpath(worker_dir)
+        os.remove(worker_dir)
+        if keep and os.path.isdir(staged):
+            os.makedirs(worker_dir, exist_ok=True)
+            for fnam in os.listdir(staged):
+                src = os.path.join(staged, fnam)
+                if _match(fnam, keep) and os.path.isfile(src) and not os.path.islink(src):
+                    shutil.copy2(src, os.path.join(worker_dir, fnam))
+    shutil.rmtree(stage, ignore_errors=True)
+
+
+def wait_for_port(host, port, timeout=60, proc=None, interval=0.2):
+    """wait until a TCP port accepts connections.
+
+    Args:
+        - host (`str`): host name
+        - port (`int`): port number
+        - timeout (`float`, optional): seconds to wait. Defaults to 60
+        - proc (`subprocess.Popen`, optional): the process that opens the port;
+            stop waiting if it exits. Defaults to None
+        - interval (`float`, optional): seconds between tries. Defaults to 0.2
+
+    Raises:
+        Exception: the port did not open in time or `proc` exited
+    """
+
+    end = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=interval).close()
+            return
+        except OSError:
+            pass
+        if proc is not None and proc.poll() is not None:
+            raise Exception("the master exited with code {} before listening on port {}".format(
+                proc.returncode, port))
+        if time.time() > end:
+            raise Exception("port {}:{} did not open within {} sec".format(host, port, timeout))
+        time.sleep(interval)
+
+
+def _parse_cpulist(text):
+    # '0-3,8-11' -> [0, 1, 2, 3, 8, 9, 10, 11]
+    cpus = []
+    for item in text.strip().split(','):
+        if '-' in item:
+            first, last = item.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif item:
+            cpus.append(int(item))
+    return cpus
+
+
+def numa_nodes():
+    """get the CPUs of each NUMA node this process may use.
+
+    Returns:
+        `dict`: CPU list of each node, {0: [0, 1, ...], 1: [...]}; a single node
+        with all usable CPUs if the node layout is not available
+    """
+
+    usable = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+        else list(range(os.cpu_count() or 1))
+    nodes = {}
+    node_dir = '/sys/devices/system/node'
+    if os.path.isdir(node_dir):
+        for name in sorted(os.listdir(node_dir)):
+            if not (name.startswith('node') and name[4:].isdigit()):
+                continue
+            try:
+                with open(os.path.join(node_dir, name, 'cpulist')) as f:
+                    cpus = [c for c in _parse_cpulist(f.read()) if c in usable]
+            except OSError:
+                continue
+            if cpus:
+                nodes[int(name[4:])] = cpus
+    return nodes or {0: usable}
+
+
+def plan_placement(n_workers, cores_per_worker=None, nodes=None):
+    """assign a NUMA node and a dedicated core set to each worker.
+
+    Args:
+        - n_workers (`int`): number of workers
+        - cores_per_worker (`int`, optional): cores of each worker. Defaults to None
+            (the usable cores divided by the workers, at least 1)
+        - nodes (`dict`, optional): CPUs of each node, see `numa_nodes`. Defaults to None
+    Note:
+        Workers are spread over the nodes in turn and get neighbouring cores of
+        their node. With more workers than cores, the core sets are shared.
+
+    Returns:
+        `list`: {'node': node, 'cpus': [...]} of each worker
+    """
+
+    nodes = numa_nodes() if nodes is None else nodes
+    ids = sorted(nodes)
+    if cores_per_worker is None:
+        total = sum(len(c) for c in nodes.values())
+        cores_per_worker = max(total // max(n_workers, 1), 1)
+    # next free core of each node
+    nxt = {n: 0 for n in ids}
+    placement = []
+    for i in range(n_workers):
+        node = ids[i % len(ids)]
+        cpus = nodes[node]
+        k = min(cores_per_worker, len(cpus))
+        if nxt[node] + k > len(cpus):
+            nxt[node] = 0
+        placement.append({'node': node, 'cpus': cpus[nxt[node]:nxt[node] + k]})
+        nxt[node] += k
+    return placement
+
+
+class RunManager(object):
+    """run BeoPEST (or a compatible program) master and workers as child processes.
+
+    Args:
+        - master_dir (`str`): the master folder, or None to start only the workers
+            (e.g. for a master on another machine)
+        - pst (`str`): the *.pst file name
+        - worker_dirs (`list`): worker folders
+        - exe (`str` or `list`, optional): the program, e.g. 'beopest64' or
+            [sys.executable, 'fake_beopest.py']. Defaults to 'beopest64'
+        - port (`int`, optional): master port. Defaults to 4005
+        - host (`str`, optional): master host for the workers. Defaults to 'localhost'
+        - max_restarts (`int`, optional): restarts of each crashed worker. Defaults to 3
+        - port_timeout (`float`, optional): seconds to wait for the master port. Defaults to 60
+        - log_file (`str`, optional): stdout/stderr file in each folder. If None, the
+            output goes to this console. Defaults to 'beopest.stdout'
+        - pin (`bool`, optional): pin each worker (and its model runs) to its own core
+            set and NUMA node, see `plan_placement`. Linux only. Defaults to False
+        - cores_per_worker (`int`, optional): cores of each pinned worker.
+            Defaults to None (all usable cores shared out)
+        - layout_file (`str`, optional): json file with the worker placement, in the
+            master folder (or next to the worker folders). Defaults to 'worker_layout.json'
+        - daemon (`str`, optional): forward run config file (in each worker folder) to
+            start a `sm_pst_daemon` with in each worker folder; use
+            'python forward_run_client.py' as the model command line then.
+            Defaults to None (no daemons)
+    Note:
+        The master is started first; the workers are started once its port accepts
+        connections. A worker that exits with a non-zero code while the master is
+        running is restarted. All processes are stopped when the master exits, on
+        Ctrl+C or on `stop`.
+        Pinned workers are started with 'numactl --preferred --physcpubind' where
+        numactl is installed, so their memory comes from the local node while it has
+        free pages and from the other nodes after that (no OOM kill as with
+        '--membind'); otherwise only the CPU affinity is set. The layout file records
+        the placement, the memory policy ("mem_policy") and "pinned": false for
+        unpinned runs, to compare the throughput of both.
+        A daemon is started after its worker, in the process group and placement of
+        the worker, so pinning, `pause`, `stop` and `LoadScaler` include the model
+        runs of the daemon (not on Windows, where it runs in its own group). It is
+        restarted with its worker.
+
+    Example:
+        rm = sm_pst_workers.RunManager('main', 'swatmf.pst', ['../worker_0', '../worker_1'], exe='beopest')
+        rm.run()
+    """
+
+    def __init__(
+                self, master_dir, pst, worker_dirs, exe='beopest64', port=4005, host='localhost',
+                max_restarts=3, port_timeout=60, log_file='beopest.stdout', pin=False,
+                cores_per_worker=None, layout_file='worker_layout.json', daemon=None):
+        self.master_dir = None if master_dir is None else os.path.abspath(master_dir)
+        self.pst = pst
+        self.worker_dirs = [os.path.abspath(d) for d in worker_dirs]
+        self.exe = [exe] if isinstance(exe, str) else list(exe)
+        self.port = int(port)
+        self.host = host
+        self.max_restarts = max_restarts
+        self.port_timeout = port_timeout
+        self.log_file = log_file
+        self.master = None
+        self.workers = [None] * len(self.worker_dirs)
+        self.restarts = [0] * len(self.worker_dirs)
+        self.paused = set()
+        self.daemon = daemon
+        self.daemons = [None] * len(self.worker_dirs)
+        self.pin = pin
+        self.placement = None
+        self.numactl = None
+        if pin:
+            if not hasattr(os, 'sched_setaffinity'):
+                raise Exception("pinning workers is not supported on this platform")
+            self.placement = plan_placement(len(self.worker_dirs), cores_per_worker)
+            self.numactl = shutil.which('numactl')
+        root = self.master_dir
+        if root is None:
+            root = os.path.dirname(self.worker_dirs[0]) if self.worker_dirs else os.getcwd()
+        self.layout_file = None if layout_file is None else os.path.join(root, layout_file)
+
+    def write_layout(self):
+        """write the worker placement to the layout file."""
+        if self.layout_file is None:
+            return
+        workers = []
+        for i, d in enumerate(self.worker_dirs):
+            rec = {'worker': d, 'pid': None if self.workers[i] is None else self.workers[i].pid}
+            if self.placement is not None:
+                rec.update(self.placement[i])
+            workers.append(rec)
+        layout = {
+            'host': socket.gethostname(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'pinned': bool(self.pin),
+            'numactl': self.numactl is not None,
+            'mem_policy': 'preferred' if self.placement is not None and self.numactl is not None else 'default',
+            'nodes': {str(k): v for k, v in numa_nodes().items()},
+            'workers': workers,
+            }
+        with open(self.layout_file, 'w') as f:
+            json.dump(layout, f, indent=1)
+
+    def _popen(self, cwd, host_arg, place=None, pgid=None):
+        if host_arg is None:
+            # the forward run daemon of a worker
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sm_pst_daemon.py')
+            cmd = [sys.executable, script, self.daemon]
+        else:
+            exe = list(self.exe)
+            # a program in the run folder, as 'start cmd /k' would find it
+            if not os.path.isabs(exe[0]) and os.path.exists(os.path.join(cwd, exe[0])):
+                exe[0] = os.path.join(cwd, exe[0])
+            cmd = exe + [self.pst, '/h', host_arg]
+        kwargs = {}
+        if os.name == 'nt':
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # own process group, so the model runs of a worker are stopped with it;
+            # a daemon joins the group of its worker (same session, so no setsid)
+            kwargs['preexec_fn'] = lambda: os.setpgid(0, pgid or 0)
+        prefix = []
+        if place is not None and self.numactl is not None:
+            prefix = [
+                self.numactl, '--preferred={}'.format(place['node']),
+                '--physcpubind={}'.format(','.join(map(str, place['cpus'])))]
+        out = None
+        if self.log_file is not None:
+            out = open(os.path.join(cwd, self.log_file), 'ab')
+        try:
+            proc = subprocess.Popen(
+                prefix + cmd, cwd=cwd, stdout=out, stderr=subprocess.STDOUT, **kwargs)
+        finally:
+            if out is not None:
+                out.close()
+        if place is not None and self.numactl is None:
+            # inherited by the model runs the worker starts
+            try:
+                os.sched_setaffinity(proc.pid, place['cpus'])
+            except OSError:
+                pass
+        return proc
+
+    def start_worker(self, i):
+        """start (or restart) worker `i` (and its daemon)."""
+        place = None if self.placement is None else self.placement[i]
+        self.stop_daemon(i)
+        self.workers[i] = self._popen(self.worker_dirs[i], '{}:{}'.format(self.host, self.port), place)
+        if self.daemon is not None:
+            self.daemons[i] = self._popen(
+                                self.worker_dirs[i], None, place,
+                                pgid=None if os.name == 'nt' else self.workers[i].pid)
+        self.paused.discard(i)
+
+    def stop_daemon(self, i, timeout=5):
+        """stop the forward run daemon of worker `i`."""
+        proc = self.daemons[i]
+        self.daemons[i] = None
+        if proc is None or proc.poll() is not None:
+            return
+        if os.name != 'nt':
+            proc.send_signal(signal.SIGCONT)
+        proc.terminate()
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def start(self):
+        """start the master, wait for its port and start the workers."""
+        if self.master_dir is not None:
+            self.master = self._popen(self.master_dir, ':{}'.format(self.port))
+            print('BeoPEST master has been started (pid {})...'.format(self.master.pid))
+        wait_for_port(self.host, self.port, self.port_timeout, self.master)
+        for i in range(len(self.worker_dirs)):
+            self.start_worker(i)
+        self.write_layout()
+        print('{} BeoPEST workers have been started{}...'.format(
+            len(self.worker_dirs), ' (pinned)' if self.pin else ''))
+
+    def _signal(self, proc, sig):
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            if os.name == 'nt':
+                proc.send_signal(sig)
+            else:
+                os.killpg(proc.pid, sig)
+        except OSError:
+            pass
+
+    def pause(self, i):
+        """stop worker `i` and its model run with SIGSTOP (not on Windows)."""
+        self._signal(self.workers[i], signal.SIGSTOP)
+        self.paused.add(i)
+
+    def resume(self, i):
+        """continue a paused worker with SIGCONT."""
+        self._signal(self.workers[i], signal.SIGCONT)
+        self.paused.discard(i)
+
+    def check_workers(self):
+        """restart the workers that crashed.
+
+        Returns:
+            `list`: restarted workers
+        """
+        restarted = []
+        for i, proc in enumerate(self.workers):
+            if proc is None or i in self.paused or proc.poll() is None or proc.returncode == 0:
+                continue
+            if self.restarts[i] >= self.max_restarts:
+                continue
+            self.restarts[i] += 1
+            print('worker {} exited with code {}, restarting ({}/{})...'.format(
+                i, proc.returncode, self.restarts[i], self.max_restarts))
+            self.start_worker(i)
+            restarted.append(i)
+        if restarted:
+            self.write_layout()
+        return restarted
+
+    def running(self):
+        """True while the master (or, without a master, any worker) runs."""
+        if self.master is not None:
+            return self.master.poll() is None
+        return any(p is not None and p.poll() is None for p in self.workers)
+
+    def monitor(self, interval=1.0, callback=None):
+        """restart crashed workers until the master exits.
+
+        Args:
+            - interval (`float`, optional): seconds between checks. Defaults to 1.0
+            - callback (`callable`, optional): called with the run manager at every
+                check, e.g. a load-aware scaler. Defaults to None
+
+        Returns:
+            `int`: exit code of the master (None without a master)
+        """
+        while self.running():
+            self.check_workers()
+            if callback is not None:
+                callback(self)
+            time.sleep(interval)
+        return None if self.master is None else self.master.returncode
+
+    def stop(self, timeout=10):
+        """stop the workers and the master: terminate, then kill after `timeout` seconds."""
+        procs = [p for p in self.workers + [self.master] if p is not None]
+        term = signal.CTRL_BREAK_EVENT if os.name == 'nt' else signal.SIGTERM
+        for proc in procs:
+            if os.name != 'nt':
+                # paused workers do not handle SIGTERM
+                self._signal(proc, signal.SIGCONT)
+            self._signal(proc, term)
+        end = time.time() + timeout
+        for proc in procs:
+            try:
+                proc.wait(max(end - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                if os.name == 'nt':
+                    proc.kill()
+                else:
+                    self._signal(proc, signal.SIGKILL)
+                proc.wait()
+        # daemons whose worker exited before (and on Windows)
+        for i in range(len(self.daemons)):
+            self.stop_daemon(i)
+
+    def run(self, interval=1.0, callback=None):
+        """start, monitor until the master exits and stop everything.
+
+        Returns:
+            `int`: exit code of the master
+        """
+        try:
+            self.start()
+            return self.monitor(interval, callback)
+        except KeyboardInterrupt:
+            print('stopping BeoPEST...')
+            return None
+        finally:
+            self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _read_meminfo():
+    info = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            key, val = line.split(':')
+            info[key] = int(val.split()[0]) * 1024
+    return info
+
+
+def _read_cpu_times():
+    # (busy, iowait, total) clock ticks of all CPUs
+    with open('/proc/stat') as f:
+        vals = [int(x) for x in f.readline().split()[1:]]
+    idle, iowait = vals[3], vals[4]
+    total = sum(vals[:8])
+    return total - idle - iowait, iowait, total
+
+
+def _group_usage(pgids):
+    """rss (bytes), cpu (clock ticks) and read+write bytes of the processes of each group."""
+    usage = {g: [0, 0, 0] for g in pgids}
+    page = os.sysconf('SC_PAGE_SIZE')
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            pgid = int(fields[2])
+            if pgid not in usage:
+                continue
+            u = usage[pgid]
+            u[0] += int(fields[21]) * page
+            u[1] += int(fields[11]) + int(fields[12])
+            try:
+                with open('/proc/{}/io'.format(pid)) as f:
+                    for line in f:
+                        if line.startswith(('read_bytes', 'write_bytes')):
+                            u[2] += int(line.split(':')[1])
+            except OSError:
+                # other users' processes
+                pass
+        except (OSError, IndexError, ValueError):
+            # the process exited
+            continue
+    return usage
+
+
+class LoadScaler(object):
+    """adjust the number of active workers of a RunManager to the measured load.
+
+    Args:
+        - min_workers (`int`, optional): fewest active workers. Defaults to 1
+        - max_workers (`int`, optional): most active workers. Defaults to None (all)
+        - start_workers (`int`, optional): active workers at the start.
+            Defaults to None (half of the CPUs, at least `min_workers`)
+        - mem_reserve_mb (`float`, optional): memory to keep available (MemAvailable).
+            Defaults to 2048
+        - cpu_target (`float`, optional): highest CPU use (0-1) before no more workers
+            are added. Defaults to 0.9
+        - iowait_max (`float`, optional): highest share of CPU time waiting for IO
+            before no more workers are added. Defaults to 0.2
+        - window (`float`, optional): seconds between decisions. Defaults to 600
+        - tolerance (`float`, optional): relative throughput change that counts as
+            a change. Defaults to 0.05
+        - log_file (`str`, optional): timing log of the forward runs in each worker
+            folder, used to count the finished runs. Defaults to 'sm_pst_timing.log'
+    Note:
+        Linux only (/proc, SIGSTOP/SIGCONT). Every `window` the throughput (forward
+        runs per hour, from the 'extract', cache hit and watchdog abort records of
+        the timing logs, see `sm_pst_prof`) is compared with the previous window: a worker is added while
+        it grows and removed when it drops (hill climbing). The memory, CPU and IO
+        limits, estimated from the measured RSS and CPU of each worker and its model
+        run, are applied first; when MemAvailable falls below the reserve, a worker
+        is paused at once. Paused workers keep their memory, so the least busy
+        worker (e.g. between model runs) is paused first. A paused worker may hold
+        a run, so all workers are resumed after a window without finished runs.
+
+    Example:
+        rm = sm_pst_workers.RunManager('main', 'swatmf.pst', worker_dirs, exe='beopest')
+        rm.run(callback=sm_pst_workers.LoadScaler(window=300))
+    """
+
+    def __init__(
+                self, min_workers=1, max_workers=None, start_workers=None, mem_reserve_mb=2048,
+                cpu_target=0.9, iowait_max=0.2, window=600, tolerance=0.05,
+                log_file='sm_pst_timing.log'):
+        if not os.path.exists('/proc/stat'):
+            raise Exception("LoadScaler needs the /proc file system (Linux)")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.start_workers = start_workers
+        self.mem_reserve = mem_reserve_mb * 2**20
+        self.cpu_target = cpu_target
+        self.iowait_max = iowait_max
+        self.window = window
+        self.tolerance = tolerance
+        self.log_file = log_file
+        self.ncpu = os.cpu_count() or 1
+        self.history = []
+        self._started = False
+
+    def _count_runs(self, rm):
+        runs = 0
+        for i, d in enumerate(rm.worker_dirs):
+            log = os.path.join(d, self.log_file)
+            try:
+                with open(log, 'rb') as f:
+                    f.seek(self._offsets[i])
+                    data = f.read()
+            except OSError:
+                continue
+            # complete lines only
+            data = data[:data.rfind(b'\n') + 1]
+            self._offsets[i] += len(data)
+            for line in data.splitlines():
+                if b'"stage": "extract"' in line:
+                    runs += 1
+                elif b'"hit": true' in line or b'"abort"' in line:
+                    # cache hits and runs stopped by the watchdog have no extract stage
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    if (rec.get('stage') == 'cache_restore' and rec.get('hit')) or (
+                            rec.get('stage') == 'model' and rec.get('abort')):
+                        runs += 1
+        return runs
+
+    def _reset_window(self, rm):
+        self._t0 = time.time()
+        self._cpu0 = _read_cpu_times()
+        self._runs = 0
+        self._usage0 = _group_usage(self._pgids(rm))
+
+    def _pgids(self, rm):
+        return [p.pid for p in rm.workers if p is not None]
+
+    def _active(self, rm):
+        return [i for i, p in enumerate(rm.workers) if p is not None and p.poll() is None and i not in rm.paused]
+
+    def _set_active(self, rm, target, usage):
+        active = self._active(rm)
+        if target > len(active):
+            for i in sorted(rm.paused)[:target - len(active)]:
+                rm.resume(i)
+        elif target < len(active):
+            # least CPU in the window first
+            def busy(i):
+                pid = rm.workers[i].pid
+                return usage.get(pid, [0, 0, 0])[1] - self._usage0.get(pid, [0, 0, 0])[1]
+            for i in sorted(active, key=busy)[:len(active) - target]:
+                rm.pause(i)
+
+    def __call__(self, rm):
+        if not self._started:
+            n = len(rm.worker_dirs)
+            self.max_workers = min(self.max_workers or n, n)
+            start = self.start_workers or max(self.min_workers, self.ncpu // 2)
+            self._offsets = [0] * n
+            self._count_runs(rm)
+            self._direction = 1
+            self._last = None
+            self._started = True
+            self._reset_window(rm)
+            self._set_active(rm, min(start, self.max_workers), {})
+            print('LoadScaler: {} of {} workers active...'.format(len(self._active(rm)), n))
+            return
+
+        active = self._active(rm)
+        self._runs += self._count_runs(rm)
+        avail = _read_meminfo().get('MemAvailable', 0)
+        if avail < self.mem_reserve and len(active) > self.min_workers:
+            self._set_active(rm, len(active) - 1, _group_usage(self._pgids(rm)))
+            print('LoadScaler: {:.0f} MB available, {} workers active...'.format(
+                avail / 2**20, len(active) - 1))
+            self._direction = -1
+            self._last = None
+            self._reset_window(rm)
+            return
+        elapsed = time.time() - self._t0
+        if elapsed < self.window:
+            return
+
+        # measure the window
+        busy1, iowait1, total1 = _read_cpu_times()
+        busy0, iowait0, total0 = self._cpu0
+        cpu = (busy1 - busy0) / max(total1 - total0, 1)
+        iowait = (iowait1 - iowait0) / max(total1 - total0, 1)
+        usage = _group_usage(self._pgids(rm))
+        tick = os.sysconf('SC_CLK_TCK')
+        rss, cores, io = [], [], []
+        for i in active:
+            pid = rm.workers[i].pid
+            u, u0 = usage.get(pid, [0, 0, 0]), self._usage0.get(pid, [0, 0, 0])
+            rss.append(u[0])
+            cores.append((u[1] - u0[1]) / tick / elapsed)
+            io.append((u[2] - u0[2]) / elapsed)
+        throughput = self._runs / elapsed * 3600
+        n = len(active)
+        if self._runs == 0 and rm.paused:
+            # a paused worker may hold the last runs of the master
+            print('LoadScaler: no finished runs, {} paused workers resumed...'.format(len(rm.paused)))
+            for i in sorted(rm.paused):
+                rm.resume(i)
+            self._last = None
+            self._reset_window(rm)
+            return
+
+        # limits from the measured use of one worker
+        limit = self.max_workers
+        if rss and max(rss) > 0:
+            limit = min(limit, n + int((avail - self.mem_reserve) // max(rss)))
+        if cores and sum(cores) > 0:
+            limit = min(limit, max(int(self.ncpu * self.cpu_target / (sum(cores) / n)), 1))
+        saturated = cpu > self.cpu_target or iowait > self.iowait_max
+
+        # hill climbing on the throughput
+        if self._last is not None:
+            if throughput < self._last * (1 - self.tolerance):
+                # back off; from a steady state, remove a worker
+                self._direction = -self._direction if self._direction else -1
+            elif throughput <= self._last * (1 + self.tolerance) and self._direction > 0:
+                self._direction = 0
+            elif self._direction == 0:
+                self._direction = 1
+        if saturated and self._direction > 0:
+            self._direction = 0
+        target = max(self.min_workers, min(n + self._direction, limit))
+        self._set_active(rm, target, usage)
+
+        rec = {
+            'time': time.time(), 'active': n, 'target': target, 'runs_per_hour': round(throughput, 2),
+            'cpu': round(cpu, 3), 'iowait': round(iowait, 3), 'mem_available_mb': round(avail / 2**20),
+            'rss_mb': round(sum(rss) / max(n, 1) / 2**20, 1) if rss else None,
+            'cores': round(sum(cores) / max(n, 1), 2) if cores else None,
+            'io_mb_s': round(sum(io) / max(n, 1) / 2**20, 2) if io else None,
+            }
+        self.history.append(rec)
+        print('LoadScaler: {runs_per_hour} runs/h, cpu {cpu}, iowait {iowait}, '
+              '{active} -> {target} workers...'.format(**rec))
+        self._last = throughput
+        self._reset_window(rm)